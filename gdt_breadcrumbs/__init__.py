@@ -46,6 +46,15 @@ would have been and the result will be used as the value for that option.
 
 Thirdly add the breadcrumb_trail template tag to your template and with a little
 bit of styling you're ready to go!
+
+Alternatively, if the site uses gdt_nav menus, the trail can follow the options
+selected in a menu group instead of the user's route, which needs no session at
+all.  Either pass the name of the menu group to the tag, e.g.
+{% breadcrumb_trail "main" %}, or set GDT_BREADCRUMB_MENU_GROUP to it in the
+settings file (in which case the BreadcrumbTracker middleware and the
+decorators aren't needed and the tracker leaves the session alone).  The trail
+runs from the 'home' link down to the option for the current page, reusing the
+hierarchy already generated if the menu itself is on the page.
 """
 
 __version__ = "1.0 beta"
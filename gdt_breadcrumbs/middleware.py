@@ -2,6 +2,9 @@ class BreadcrumbTracker(object):
   def process_view(self, request, view_function, view_args, view_kwargs):
     from gdt_breadcrumbs import BREADCRUMB_URL, BREADCRUMB_TRAIL
     from django.conf import settings
+    if getattr(settings, 'GDT_BREADCRUMB_MENU_GROUP', None) is not None:
+      # The trail comes from the menu so there's nothing to track.
+      return
     reset = getattr(view_function, 'reset_breadcrumbs', False)
     if reset is True or (callable(reset) \
         and reset(request, view_args, view_kwargs)) or \
@@ -3,11 +3,20 @@ from django import template
 register = template.Library()
 
 @register.inclusion_tag('breadcrumb_tag.djt', takes_context=True)
-def breadcrumb_trail(context):
+def breadcrumb_trail(context, menu_group=None):
   from gdt_breadcrumbs import BREADCRUMB_URL, BREADCRUMB_TRAIL
   from django.conf import settings
+  if menu_group is None:
+    menu_group = getattr(settings, 'GDT_BREADCRUMB_MENU_GROUP', None)
   trail = []
-  if 'request' in context:
+  if menu_group is not None:
+    # Follow the options selected in the menu rather than the session.
+    if 'request' in context:
+      trail = _menu_trail(context['request'], menu_group)
+    if trail and trail[0][0] == settings.GDT_BREADCRUMB_ROOT_URL:
+      trail = trail[1:]
+    trail = [(settings.GDT_BREADCRUMB_ROOT_URL, settings.GDT_BREADCRUMB_ROOT_TITLE)] + trail
+  elif 'request' in context:
     urls = context['request'].session.get(BREADCRUMB_URL, [])
     crumbs = context['request'].session.get(BREADCRUMB_TRAIL, {})
     for url in urls:
@@ -15,3 +24,16 @@ def breadcrumb_trail(context):
   if not trail:
     trail = ((settings.GDT_BREADCRUMB_ROOT_URL, settings.GDT_BREADCRUMB_ROOT_TITLE),)
   return { 'breadcrumbs' : trail }
+
+def _menu_trail(request, menu_group):
+  from gdt_nav.models import MenuGroup
+  from gdt_nav.preload import get_preloaded_group
+  if not isinstance(menu_group, MenuGroup):
+    name = menu_group
+    menu_group = get_preloaded_group(request, name)
+    if menu_group is None:
+      try:
+        menu_group = MenuGroup.objects.get(name=name)
+      except (MenuGroup.DoesNotExist, MenuGroup.MultipleObjectsReturned), e:
+        return []
+  return menu_group.generate_trail(request)
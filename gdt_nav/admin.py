@@ -1,11 +1,18 @@
 from models import MenuGroup, MenuOption
+from bulk import BulkChangeError, move_menu_options, reorder_menu_options, \
+                 set_menu_option_visibility
+from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse, NoReverseMatch
-from django.contrib.admin import site, ModelAdmin, VERTICAL
+from django.contrib.admin import site, ModelAdmin, VERTICAL, helpers
 from django.contrib.sites.models import Site
+from django.http import HttpResponse, HttpResponseBadRequest, \
+                        HttpResponseNotAllowed
+from django.shortcuts import render_to_response
+from django.template import RequestContext
 from django.utils.functional import update_wrapper
-from django.utils.translation import ugettext as _
+from django.utils.translation import ugettext as _, ugettext_lazy
 from forms import AbsoluteMenuOptionForm, ModelMenuOptionForm,\
-                  NamedMenuOptionForm
+                  NamedMenuOptionForm, MoveMenuOptionsForm
 
 class MenuGroupAdmin(ModelAdmin):
   change_form_template = "admin_menugroup_change_form.html"
@@ -27,6 +34,26 @@ class MenuGroupAdmin(ModelAdmin):
 
 site.register(MenuGroup, MenuGroupAdmin)
 
+def _visibility_action(field, value, description):
+  """Helper function to create an admin action that shows options to (or
+  hides them from) a type of user.
+
+  Keyword arguments:
+  field -- The show_to_* field to set.
+  value -- The value to set it to.
+  description -- The description of the action.
+
+  """
+
+  def action(modeladmin, request, queryset):
+    changed = set_menu_option_visibility(
+                list(queryset.values_list('pk', flat=True)), **{field: value})
+    modeladmin.message_user(request, _("Changed %(count)d menu options.") %
+                                     {'count': changed})
+  action.__name__ = '%s_%s' % (value and 'set' or 'clear', field)
+  action.short_description = description
+  return action
+
 class MenuOptionAdmin(ModelAdmin):
   list_display = ('name', 'option_type', 'menu_group',)
   search_fields = ('name',)
@@ -40,6 +67,20 @@ class MenuOptionAdmin(ModelAdmin):
   radio_fields = {'option_type':VERTICAL,}
   change_list_template = "admin_menuoption_change_list.html"
   change_form_template = "admin_menuoption_change_form.html"
+  actions = ['move_options',
+             _visibility_action('show_to_anonymous', True,
+                                ugettext_lazy("Show selected menu options to anonymous users")),
+             _visibility_action('show_to_anonymous', False,
+                                ugettext_lazy("Hide selected menu options from anonymous users")),
+             _visibility_action('show_to_authenticated', True,
+                                ugettext_lazy("Show selected menu options to authenticated users")),
+             _visibility_action('show_to_authenticated', False,
+                                ugettext_lazy("Hide selected menu options from authenticated users")),
+             _visibility_action('show_to_staff', True,
+                                ugettext_lazy("Show selected menu options to staff")),
+             _visibility_action('show_to_staff', False,
+                                ugettext_lazy("Hide selected menu options from staff")),
+            ]
   fieldsets = (
     (None, {'fields': ('option_type',
                        'name',
@@ -79,6 +120,10 @@ class MenuOptionAdmin(ModelAdmin):
                                       'model_id',
                                       'order_by',
                                       'result_limit',
+                                      'label_field',
+                                      'select_related',
+                                      'cache_timeout',
+                                      'paginate',
                                      ),
                            'description':'Extra information that may or may not be required depending on the type of menu option.',
                           },
@@ -154,6 +199,56 @@ class MenuOptionAdmin(ModelAdmin):
     extra_context['menu_groups'] = MenuGroup.objects.order_by('name')
     return ModelAdmin.changelist_view(self, request, extra_context)
 
+  def move_options(self, request, queryset):
+    """Admin action to move options (along with their sub-menus) to another
+    menu group and/or parent.
+
+    """
+
+    if 'apply' in request.POST:
+      form = MoveMenuOptionsForm(request.POST)
+      if form.is_valid():
+        try:
+          moved = move_menu_options(list(queryset.values_list('pk', flat=True)),
+                                    form.cleaned_data['menu_group'],
+                                    form.cleaned_data['parent'])
+        except BulkChangeError, e:
+          self.message_user(request, str(e))
+        else:
+          self.message_user(request, _("Moved %(count)d menu options.") %
+                                     {'count': moved})
+        return None
+    else:
+      form = MoveMenuOptionsForm()
+    context = {'form': form,
+               'queryset': queryset,
+               'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+               'app_label': _("GDT Nav"),
+               'opts': self.model._meta,
+              }
+    return render_to_response("admin_menuoption_move.html", context,
+                              context_instance=RequestContext(request))
+  move_options.short_description = ugettext_lazy("Move selected menu options")
+
+  def reorder_view(self, request):
+    """Put all of the options under a parent into a new order.
+
+    Expects a POST with an 'option' value for each of the options, by id, in
+    their new order (as sent by a drag and drop list) and updates them all with
+    a single query.
+
+    """
+
+    if request.method != 'POST':
+      return HttpResponseNotAllowed(['POST'])
+    if not self.has_change_permission(request):
+      raise PermissionDenied
+    try:
+      reorder_menu_options(request.POST.getlist('option'))
+    except BulkChangeError, e:
+      return HttpResponseBadRequest(str(e), mimetype='text/plain')
+    return HttpResponse('OK', mimetype='text/plain')
+
   def get_urls(self):
     from django.conf.urls.defaults import patterns, url
     urlpatterns = ModelAdmin.get_urls(self)
@@ -168,6 +263,9 @@ class MenuOptionAdmin(ModelAdmin):
       url(r'^add/(?P<option_type>\d)/$',
           wrap(self.add_view),
           name='%s_%s_add_by_type' % info),
+      url(r'^reorder/$',
+          wrap(self.reorder_view),
+          name='%s_%s_reorder' % info),
     ) + urlpatterns
     return urlpatterns
 
@@ -314,6 +412,10 @@ class ModelMenuOptionAdmin(ModelAdmin):
                                       'model_id',
                                       'order_by',
                                       'result_limit',
+                                      'label_field',
+                                      'select_related',
+                                      'cache_timeout',
+                                      'paginate',
                                      ),
                            'description':'Information describing the model and query that will select what should appear for this menu item.',
                           },
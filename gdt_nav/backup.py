@@ -0,0 +1,315 @@
+"""
+Backup and restore of menu groups.
+
+A menu group is dumped as a dictionary (suitable for serialising as JSON)
+holding the group's details and a list of its options.  Options refer to their
+parents using the option's original id and to their content types,
+permissions and sites using natural keys so that a dump can be loaded into a
+different database (e.g. promoting menus from staging to production).
+"""
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.db import transaction
+from gdt_nav.cache import defer_menu_version_bumps, flush_menu_version_bumps
+from gdt_nav.models import MenuGroup, MenuOption
+
+
+# Fields of MenuOption that aren't copied directly between the dump and the
+# model.
+_SPECIAL_FIELDS = ('id', 'menu_group', 'parent', 'content_type')
+
+
+class MenuLoadError(Exception):
+  """Raised when a menu group dump can't be loaded.
+
+  """
+  pass
+
+
+def dump_menu_group(menu_group):
+  """Generate a dictionary representing a menu group and all of its options.
+
+  Keyword arguments:
+  menu_group -- The menu group to dump.
+
+  """
+
+  options = menu_group.menu_items.select_related('content_type')\
+                                 .order_by('parent', 'ordering', 'pk')
+  option_list = []
+  option_dicts = {}
+  for option in options:
+    option_dict = { 'key': option.pk,
+                    'parent': option.parent_id,
+                    'permissions': [],
+                  }
+    for field in MenuOption._meta.fields:
+      if field.name not in _SPECIAL_FIELDS:
+        option_dict[field.name] = getattr(option, field.attname)
+    if option.content_type is not None:
+      option_dict['content_type'] = [option.content_type.app_label,
+                                     option.content_type.model]
+    else:
+      option_dict['content_type'] = None
+    if Site._meta.installed:
+      option_dict['sites'] = []
+    option_list.append(option_dict)
+    option_dicts[option.pk] = option_dict
+
+  # Fetch the relations for all options at once rather than one at a time.
+  permission_links = MenuOption.permissions.through.objects\
+                       .filter(menuoption__menu_group=menu_group)\
+                       .select_related('permission__content_type')
+  for link in permission_links:
+    permission = link.permission
+    option_dicts[link.menuoption_id]['permissions'].append(
+      [permission.codename,
+       permission.content_type.app_label,
+       permission.content_type.model])
+  if Site._meta.installed:
+    site_links = MenuOption.sites.through.objects\
+                   .filter(menuoption__menu_group=menu_group)\
+                   .select_related('site')
+    for link in site_links:
+      option_dicts[link.menuoption_id]['sites'].append(link.site.domain)
+
+  return { 'group': { 'name': menu_group.name,
+                      'notes': menu_group.notes,
+                    },
+           'options': option_list,
+         }
+
+def load_menu_group(data):
+  """Load a menu group from a dictionary produced by dump_menu_group.
+
+  If a menu group with the same name already exists then its options are
+  replaced by the ones being loaded.  Everything happens in a single
+  transaction, options are inserted in bulk one level of the hierarchy at a
+  time and the menu version is only bumped once everything has been loaded.
+
+  Keyword arguments:
+  data -- The dictionary describing the menu group.
+
+  Returns:
+  The loaded menu group.
+
+  """
+
+  defer_menu_version_bumps()
+  try:
+    return _load_menu_group(data)
+  finally:
+    flush_menu_version_bumps()
+
+@transaction.commit_on_success
+def _load_menu_group(data):
+  """Helper function to load a menu group inside a transaction.
+
+  Keyword arguments:
+  data -- The dictionary describing the menu group.
+
+  """
+
+  levels = _order_options(data['options'])
+  content_types = _fetch_content_types(data['options'])
+  permissions = _fetch_permissions(data['options'])
+  if Site._meta.installed:
+    sites = _fetch_sites(data['options'])
+
+  try:
+    menu_group = MenuGroup.objects.get(name=data['group']['name'])
+    menu_group.notes = data['group'].get('notes', '')
+    menu_group.save()
+    menu_group.menu_items.all().delete()
+  except MenuGroup.DoesNotExist, e:
+    menu_group = MenuGroup.objects.create(name=data['group']['name'],
+                                          notes=data['group'].get('notes', ''))
+
+  field_names = [field.name for field in MenuOption._meta.fields
+                 if field.name not in _SPECIAL_FIELDS]
+  option_ids = {} # Maps the keys in the dump to the ids of new options.
+  permission_links = []
+  site_links = []
+  for level in levels:
+    new_options = []
+    for option_dict in level:
+      option = MenuOption(menu_group=menu_group,
+                          parent_id=option_ids.get(option_dict.get('parent')))
+      for name in field_names:
+        if name in option_dict:
+          setattr(option, MenuOption._meta.get_field(name).attname,
+                  option_dict[name])
+      if option_dict.get('content_type'):
+        option.content_type = content_types[tuple(option_dict['content_type'])]
+      new_options.append(option)
+    _bulk_insert(MenuOption, new_options)
+    _fetch_inserted_ids(menu_group, new_options)
+    for option_dict, option in zip(level, new_options):
+      option_ids[option_dict['key']] = option.pk
+      for natural_key in option_dict.get('permissions', []):
+        permission_links.append(MenuOption.permissions.through(
+          menuoption_id=option.pk,
+          permission_id=permissions[tuple(natural_key)]))
+      if Site._meta.installed:
+        for domain in option_dict.get('sites', []):
+          site_links.append(MenuOption.sites.through(menuoption_id=option.pk,
+                                                     site_id=sites[domain]))
+  _bulk_insert(MenuOption.permissions.through, permission_links)
+  if Site._meta.installed:
+    _bulk_insert(MenuOption.sites.through, site_links)
+  return menu_group
+
+def _order_options(option_dicts):
+  """Helper function to split options into levels of the hierarchy.
+
+  Keyword arguments:
+  option_dicts -- The option dictionaries from the dump.
+
+  Returns:
+  A list of lists of option dictionaries, the first containing the top level
+  options and each subsequent list containing the children of the options in
+  the previous list.
+
+  """
+
+  keys = set([option_dict['key'] for option_dict in option_dicts])
+  levels = []
+  placed = set()
+  remaining = list(option_dicts)
+  while remaining:
+    level = []
+    unplaced = []
+    for option_dict in remaining:
+      parent = option_dict.get('parent')
+      if parent is not None and parent not in keys:
+        raise MenuLoadError("Option '%s' has an unknown parent (%s)." %
+                            (option_dict['name'], parent))
+      if parent is None or parent in placed:
+        level.append(option_dict)
+      else:
+        unplaced.append(option_dict)
+    if not level:
+      raise MenuLoadError("The option hierarchy contains a loop.")
+    placed.update([option_dict['key'] for option_dict in level])
+    levels.append(level)
+    remaining = unplaced
+  return levels
+
+def _fetch_content_types(option_dicts):
+  """Helper function to look up the content types used by options.
+
+  Keyword arguments:
+  option_dicts -- The option dictionaries from the dump.
+
+  Returns:
+  A dictionary mapping (app_label, model) tuples to ContentType objects.
+
+  """
+
+  content_types = {}
+  for option_dict in option_dicts:
+    natural_key = option_dict.get('content_type')
+    if natural_key and tuple(natural_key) not in content_types:
+      try:
+        content_types[tuple(natural_key)] = ContentType.objects.get(
+          app_label=natural_key[0], model=natural_key[1])
+      except ContentType.DoesNotExist, e:
+        raise MenuLoadError("Unknown content type %s.%s." % tuple(natural_key))
+  return content_types
+
+def _fetch_permissions(option_dicts):
+  """Helper function to look up the ids of the permissions used by options.
+
+  Keyword arguments:
+  option_dicts -- The option dictionaries from the dump.
+
+  Returns:
+  A dictionary mapping (codename, app_label, model) tuples to permission ids.
+
+  """
+
+  natural_keys = set()
+  for option_dict in option_dicts:
+    natural_keys.update([tuple(key) for key in option_dict.get('permissions', [])])
+  codenames = set([key[0] for key in natural_keys])
+  permissions = {}
+  for permission in Permission.objects.filter(codename__in=codenames)\
+                                      .select_related('content_type'):
+    permissions[(permission.codename,
+                 permission.content_type.app_label,
+                 permission.content_type.model)] = permission.pk
+  for natural_key in natural_keys:
+    if natural_key not in permissions:
+      raise MenuLoadError("Unknown permission %s (%s.%s)." % natural_key)
+  return permissions
+
+def _fetch_sites(option_dicts):
+  """Helper function to look up the ids of the sites used by options.
+
+  Keyword arguments:
+  option_dicts -- The option dictionaries from the dump.
+
+  Returns:
+  A dictionary mapping domains to site ids.
+
+  """
+
+  domains = set()
+  for option_dict in option_dicts:
+    domains.update(option_dict.get('sites', []))
+  sites = dict(Site.objects.filter(domain__in=domains)\
+                           .values_list('domain', 'pk'))
+  for domain in domains:
+    if domain not in sites:
+      raise MenuLoadError("Unknown site %s." % domain)
+  return sites
+
+def _bulk_insert(model, objs):
+  """Helper function to insert a list of new objects in as few queries as possible.
+
+  Uses bulk_create on versions of django that provide it, otherwise each
+  object is saved as raw data.
+
+  Keyword arguments:
+  model -- The model class of the objects.
+  objs -- The unsaved objects to insert.
+
+  """
+
+  if not objs:
+    return
+  if hasattr(model.objects, 'bulk_create'):
+    model.objects.bulk_create(objs)
+  else:
+    for obj in objs:
+      obj.save_base(raw=True, force_insert=True)
+
+def _fetch_inserted_ids(menu_group, options):
+  """Helper function to fill in the ids of options inserted by _bulk_insert.
+
+  Some database backends can't report the ids of rows inserted in bulk, in
+  which case the newly inserted options are found by looking for the options
+  in the group that don't yet have children loaded below them, in the order
+  they were inserted.
+
+  Keyword arguments:
+  menu_group -- The menu group the options were inserted into.
+  options -- The list of options that were inserted.
+
+  """
+
+  if not options or options[0].pk is not None:
+    return
+  parent_ids = set([option.parent_id for option in options])
+  if None in parent_ids:
+    inserted = menu_group.menu_items.filter(parent__isnull=True)
+  else:
+    inserted = menu_group.menu_items.filter(parent__in=parent_ids)
+  inserted = list(inserted.order_by('pk').values_list('pk', 'name'))
+  if len(inserted) != len(options):
+    raise MenuLoadError("Unable to determine the ids of the loaded options.")
+  for option, (pk, name) in zip(options, inserted):
+    if name != option.name:
+      raise MenuLoadError("Unable to determine the ids of the loaded options.")
+    option.pk = pk
@@ -0,0 +1,12 @@
+"""
+A benchmark harness for gdt_nav menu rendering.
+
+Generates a synthetic menu group of a configurable size, depth, option type
+mix and permission density in an in-memory SQLite database with a synthetic
+urlconf and reports the wall time, queries and allocations of each stage of
+rendering the menu.  Run it from a directory where gdt_nav is importable:
+
+  python -m gdt_nav.benchmarks.run --options 500 --depth 4
+
+Use --help for the full list of options.
+"""
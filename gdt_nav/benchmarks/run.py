@@ -0,0 +1,266 @@
+"""
+Run the gdt_nav menu rendering benchmarks.
+
+"""
+import cPickle as pickle
+import gc
+import os
+import random
+import time
+from optparse import OptionParser
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gdt_nav.benchmarks.settings')
+
+
+def build_menu(options):
+  """Generate a synthetic menu group to benchmark against.
+
+  Keyword arguments:
+  options -- The parsed command line options.
+
+  Returns:
+  The generated menu group.
+
+  """
+
+  from django.contrib.auth.models import Permission
+  from django.contrib.contenttypes.models import ContentType
+  from django.contrib.sites.models import Site
+  from gdt_nav.benchmarks.urls import URL_COUNT
+  from gdt_nav.models import MenuGroup, MenuOption
+
+  rand = random.Random(options.seed)
+  weights = dict([(MenuOption.ABSOLUTE_URL_MENU_OPTION, options.absolute),
+                  (MenuOption.NAMED_URL_MENU_OPTION, options.named),
+                  (MenuOption.MODEL_MENU_OPTION, options.model)])
+  type_choices = []
+  for option_type, weight in weights.items():
+    type_choices += [option_type] * weight
+  permissions = list(Permission.objects.all())
+  content_type = ContentType.objects.get_for_model(ContentType)
+
+  menu_group = MenuGroup.objects.create(name='benchmark')
+  levels = [[] for i in range(options.depth)]
+  for i in range(options.options):
+    # Spread the options over the levels, making sure the first option on
+    # each level has a parent available.
+    depth = rand.randint(0, options.depth - 1)
+    while depth and not levels[depth - 1]:
+      depth -= 1
+    parent = None
+    if depth:
+      parent = rand.choice(levels[depth - 1])
+    option_type = rand.choice(type_choices)
+    option = MenuOption(name='Option %d' % i,
+                        alt_text='Option %d' % i,
+                        option_type=option_type,
+                        menu_group=menu_group,
+                        ordering=i,
+                        parent=parent,
+                        show_to_anonymous=rand.random() < 0.5)
+    if option_type == MenuOption.ABSOLUTE_URL_MENU_OPTION:
+      option.url = 'http://testserver/section/%d/' % (i % URL_COUNT)
+    elif option_type == MenuOption.NAMED_URL_MENU_OPTION:
+      if rand.random() < 0.5:
+        option.url_name = 'bench_section_%d' % (i % URL_COUNT)
+      else:
+        option.url_name = 'bench_detail_%d' % (i % URL_COUNT)
+    else:
+      option.url_name = 'bench_model'
+      option.content_type = content_type
+      option.manager = 'objects'
+      option.url_id = 'slug'
+      option.model_id = 'model'
+      option.order_by = 'model'
+      option.result_limit = options.model_results
+    option.save()
+    if Site._meta.installed:
+      option.sites.add(Site.objects.get_current())
+    if permissions and rand.random() < options.permission_density:
+      option.permissions.add(*rand.sample(permissions, 2))
+    levels[depth].append(option)
+  return menu_group
+
+def build_request(options):
+  """Generate a request for the benchmark path as the chosen type of user.
+
+  Keyword arguments:
+  options -- The parsed command line options.
+
+  """
+
+  from django.contrib.auth.models import AnonymousUser, Permission, User
+  from django.test.client import RequestFactory
+
+  request = RequestFactory().get(options.path)
+  if options.user == 'anonymous':
+    request.user = AnonymousUser()
+  else:
+    user, created = User.objects.get_or_create(username='benchmark')
+    user.is_staff = options.user == 'staff'
+    user.save()
+    permissions = list(Permission.objects.all())
+    user.user_permissions = permissions[:len(permissions) / 2]
+    # Fetch the user again so that the permission cache starts empty.
+    request.user = User.objects.get(pk=user.pk)
+  return request
+
+def measure(func, *args, **kwargs):
+  """Call a function and measure its cost.
+
+  Keyword arguments:
+  func -- The function to call.
+  args -- The arguments to call the function with.
+  kwargs -- The keyword arguments to call the function with.
+
+  Returns:
+  A tuple of (result, seconds, queries, allocations).  When tracemalloc is
+  available allocations is the number of bytes allocated, otherwise it is the
+  number of objects left tracked by the garbage collector.
+
+  """
+
+  from django.db import connection, reset_queries
+
+  reset_queries()
+  gc.collect()
+  gc.disable()
+  if tracemalloc is not None:
+    tracemalloc.start()
+  else:
+    objects_before = len(gc.get_objects())
+  try:
+    start = time.time()
+    result = func(*args, **kwargs)
+    seconds = time.time() - start
+  finally:
+    if tracemalloc is not None:
+      allocations = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    else:
+      allocations = len(gc.get_objects()) - objects_before
+    gc.enable()
+  return result, seconds, len(connection.queries), allocations
+
+def measure_pickling(menu_group, repeat):
+  """Compare pickling a menu tree with pickling the menu options themselves.
+
+  Keyword arguments:
+  menu_group -- The menu group to pickle.
+  repeat -- The number of times to load each pickle.
+
+  Returns:
+  A list of tuples of (label, pickled bytes, mean load seconds).
+
+  """
+
+  from gdt_nav.tree import load_menu_tree
+
+  candidates = (('MenuOption list', list(menu_group.menu_items.all())),
+                ('MenuTree', load_menu_tree(menu_group)))
+  results = []
+  for label, obj in candidates:
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    start = time.time()
+    for i in range(repeat):
+      pickle.loads(data)
+    results.append((label, len(data), (time.time() - start) / repeat))
+  return results
+
+def run(options):
+  """Run the benchmarks and print the results.
+
+  Keyword arguments:
+  options -- The parsed command line options.
+
+  """
+
+  from django.core.cache import cache
+  from django.core.management import call_command
+  from gdt_nav.templatetags.menu_tags import _generate_menu_string
+
+  call_command('syncdb', interactive=False, verbosity=0)
+  menu_group = build_menu(options)
+  request = build_request(options)
+
+  stages = ('_fetch_current_url_parts', 'generate_hierarchy',
+            '_generate_menu_string')
+  results = dict([(stage, []) for stage in stages])
+  for i in range(options.repeat):
+    if options.cold:
+      cache.clear()
+    # Make sure the url is resolved and the hierarchy generated again rather
+    # than using the results saved on the request by the previous run.
+    request.__dict__.pop('_gdt_nav_url_parts', None)
+    request.__dict__.pop('_gdt_nav_hierarchies', None)
+    results['_fetch_current_url_parts'].append(
+      measure(menu_group._fetch_current_url_parts, request)[1:])
+    hierarchy, seconds, queries, allocations = measure(
+      menu_group.generate_hierarchy, request)
+    results['generate_hierarchy'].append((seconds, queries, allocations))
+    hierarchies, selected_items, selected_params = hierarchy
+    results['_generate_menu_string'].append(
+      measure(_generate_menu_string, hierarchies, "ROOT", selected_items,
+              selected_params, "ul", "li")[1:])
+
+  if tracemalloc is not None:
+    allocation_label = 'peak bytes'
+  else:
+    allocation_label = 'gc objects'
+  print "%d options, depth %d, %s user, path %s, %d runs" % \
+        (options.options, options.depth, options.user, options.path,
+         options.repeat)
+  print "%-26s %10s %10s %8s %12s" % ('stage', 'min ms', 'mean ms',
+                                      'queries', allocation_label)
+  for stage in stages:
+    timings = [seconds for seconds, queries, allocations in results[stage]]
+    seconds, queries, allocations = results[stage][-1]
+    print "%-26s %10.2f %10.2f %8d %12d" % (stage,
+                                            min(timings) * 1000,
+                                            sum(timings) * 1000 / len(timings),
+                                            queries,
+                                            allocations)
+  print
+  print "%-26s %10s %10s" % ('pickled', 'bytes', 'load ms')
+  for label, size, seconds in measure_pickling(menu_group, options.repeat):
+    print "%-26s %10d %10.2f" % (label, size, seconds * 1000)
+
+def main():
+  parser = OptionParser(usage="%prog [options]")
+  parser.add_option('--options', type='int', default=200,
+                    help="Number of menu options to generate (default %default).")
+  parser.add_option('--depth', type='int', default=3,
+                    help="Maximum depth of the menu hierarchy (default %default).")
+  parser.add_option('--absolute', type='int', default=1,
+                    help="Relative weight of absolute url options (default %default).")
+  parser.add_option('--named', type='int', default=2,
+                    help="Relative weight of named url options (default %default).")
+  parser.add_option('--model', type='int', default=1,
+                    help="Relative weight of model options (default %default).")
+  parser.add_option('--model-results', type='int', default=5,
+                    dest='model_results',
+                    help="Result limit of model options (default %default).")
+  parser.add_option('--permission-density', type='float', default=0.2,
+                    dest='permission_density',
+                    help="Fraction of options that require permissions (default %default).")
+  parser.add_option('--user', default='authenticated',
+                    choices=('anonymous', 'authenticated', 'staff'),
+                    help="The type of user viewing the menu (default %default).")
+  parser.add_option('--path', default='/model/contenttype/',
+                    help="The path of the page the menu is rendered for (default %default).")
+  parser.add_option('--repeat', type='int', default=10,
+                    help="Number of times to render the menu (default %default).")
+  parser.add_option('--cold', action='store_true', default=False,
+                    help="Clear the cache before each run.")
+  parser.add_option('--seed', type='int', default=0,
+                    help="Seed for generating the menu (default %default).")
+  options, args = parser.parse_args()
+  run(options)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,20 @@
+# Settings used when running the gdt_nav benchmarks.
+DEBUG = True
+DATABASES = {
+  'default': {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': ':memory:',
+  },
+}
+DATABASE_ENGINE = 'sqlite3'
+DATABASE_NAME = ':memory:'
+CACHE_BACKEND = 'locmem://'
+SITE_ID = 1
+SECRET_KEY = 'gdt_nav benchmarks'
+ROOT_URLCONF = 'gdt_nav.benchmarks.urls'
+INSTALLED_APPS = (
+  'django.contrib.auth',
+  'django.contrib.contenttypes',
+  'django.contrib.sites',
+  'gdt_nav',
+)
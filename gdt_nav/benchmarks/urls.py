@@ -0,0 +1,19 @@
+from django.conf.urls.defaults import patterns, url
+from django.http import HttpResponse
+
+
+# The number of named urls of each kind to generate.
+URL_COUNT = 100
+
+def view(request, **kwargs):
+  return HttpResponse('')
+
+urlpatterns = patterns('',
+  url(r'^$', view, name='bench_home'),
+  url(r'^model/(?P<slug>[\w-]+)/$', view, name='bench_model'),
+)
+for i in range(URL_COUNT):
+  urlpatterns += patterns('',
+    url(r'^section/%d/$' % i, view, name='bench_section_%d' % i),
+    url(r'^section/%d/(?P<slug>[\w-]+)/$' % i, view, name='bench_detail_%d' % i),
+  )
@@ -0,0 +1,189 @@
+"""
+Bulk changes to menu options.
+
+Saving options one at a time runs the signal hooks and invalidates the menu
+data of their group for every option.  The functions here make their changes
+with a handful of queries inside a single transaction and then bump the
+version of each affected menu group once, after the transaction has been
+committed.
+"""
+from django.db import connection, transaction
+from gdt_nav.cache import bump_menu_version, defer_menu_version_bumps, \
+                          flush_menu_version_bumps
+from gdt_nav.models import MenuOption
+
+
+class BulkChangeError(Exception):
+  """Raised when a bulk change can't be made.
+
+  """
+  pass
+
+
+def reorder_menu_options(option_ids):
+  """Put all of the options under a parent into a new order.
+
+  The options are updated with a single UPDATE statement, reusing their
+  existing ordering values so that their positions relative to options
+  elsewhere in the group aren't disturbed.
+
+  Keyword arguments:
+  option_ids -- The ids of the options in their new order, which must be all
+                of the options with the same group and parent.
+
+  """
+
+  defer_menu_version_bumps()
+  try:
+    _reorder_menu_options(option_ids)
+  finally:
+    flush_menu_version_bumps()
+
+def move_menu_options(option_ids, menu_group, parent=None):
+  """Move options (along with their sub-menus) to a new group and/or parent.
+
+  Keyword arguments:
+  option_ids -- The ids of the options to move.
+  menu_group -- The menu group to move the options to.
+  parent -- The option to move the options under, which must be in
+            menu_group, or None to move them to the top level (default None).
+
+  Returns:
+  The number of options moved, not counting the options in their sub-menus
+  (including any that were given as well).
+
+  """
+
+  defer_menu_version_bumps()
+  try:
+    return _move_menu_options(option_ids, menu_group, parent)
+  finally:
+    flush_menu_version_bumps()
+
+def set_menu_option_visibility(option_ids, **flags):
+  """Change who options are shown to.
+
+  Keyword arguments:
+  option_ids -- The ids of the options to change.
+  flags -- The values to set of any of show_to_anonymous,
+           show_to_authenticated and show_to_staff.
+
+  Returns:
+  The number of options changed.
+
+  """
+
+  for name in flags:
+    if name not in ('show_to_anonymous', 'show_to_authenticated',
+                    'show_to_staff'):
+      raise BulkChangeError("%s can't be changed in bulk." % name)
+  defer_menu_version_bumps()
+  try:
+    return _set_menu_option_visibility(option_ids, flags)
+  finally:
+    flush_menu_version_bumps()
+
+@transaction.commit_on_success
+def _reorder_menu_options(option_ids):
+  """Helper function to reorder options inside a transaction.
+
+  Keyword arguments:
+  option_ids -- The ids of the options in their new order.
+
+  """
+
+  try:
+    option_ids = [int(option_id) for option_id in option_ids]
+  except (TypeError, ValueError), e:
+    raise BulkChangeError("Menu options must be given by their ids.")
+  rows = MenuOption.objects.filter(pk__in=option_ids)\
+                           .values_list('menu_group', 'parent', 'ordering')
+  if not option_ids or len(rows) != len(option_ids) \
+    or len(set(option_ids)) != len(option_ids):
+    raise BulkChangeError("Unknown or repeated menu options.")
+  positions = set([(group_id, parent_id) for group_id, parent_id, ordering
+                   in rows])
+  if len(positions) != 1:
+    raise BulkChangeError("The menu options don't share the same parent.")
+  group_id, parent_id = positions.pop()
+  if MenuOption.objects.filter(menu_group=group_id, parent=parent_id)\
+                       .count() != len(option_ids):
+    raise BulkChangeError("All of the menu options under the parent must be given.")
+  orderings = sorted([ordering for group_id, parent_id, ordering in rows])
+  if len(set(orderings)) != len(orderings):
+    # Options with the same ordering would stay in an arbitrary order.
+    orderings = range(orderings[0], orderings[0] + len(orderings))
+  quote_name = connection.ops.quote_name
+  opts = MenuOption._meta
+  pk_column = quote_name(opts.pk.column)
+  params = []
+  for option_id, ordering in zip(option_ids, orderings):
+    params.extend([option_id, ordering])
+  params.extend(option_ids)
+  sql = "UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)" % \
+        (quote_name(opts.db_table),
+         quote_name(opts.get_field('ordering').column),
+         pk_column,
+         ' '.join(['WHEN %s THEN %s'] * len(option_ids)),
+         pk_column,
+         ', '.join(['%s'] * len(option_ids)))
+  connection.cursor().execute(sql, params)
+  bump_menu_version(group_id)
+
+@transaction.commit_on_success
+def _move_menu_options(option_ids, menu_group, parent):
+  """Helper function to move options inside a transaction.
+
+  Keyword arguments:
+  option_ids -- The ids of the options to move.
+  menu_group -- The menu group to move the options to.
+  parent -- The option to move the options under, or None.
+
+  """
+
+  if parent is not None and parent.menu_group_id != menu_group.pk:
+    raise BulkChangeError("The parent must be in the menu group the options are moved to.")
+  option_ids = set([int(option_id) for option_id in option_ids])
+  # Find everything in the options' sub-menus, which has to move group too.
+  descendant_ids = set()
+  parent_ids = option_ids
+  while parent_ids:
+    parent_ids = set(MenuOption.objects.filter(parent__in=parent_ids)
+                                       .values_list('pk', flat=True))\
+                 - option_ids - descendant_ids
+    descendant_ids |= parent_ids
+  if parent is not None and parent.pk in option_ids | descendant_ids:
+    raise BulkChangeError("Menu options can't be moved into their own sub-menus.")
+  group_ids = set(MenuOption.objects.filter(pk__in=option_ids | descendant_ids)
+                                    .values_list('menu_group', flat=True))
+  # Options selected along with an option they're under keep their place in
+  # its sub-menu and move with it, like the rest of the sub-menu.
+  nested_ids = set(MenuOption.objects
+                     .filter(pk__in=option_ids,
+                             parent__in=option_ids | descendant_ids)
+                     .values_list('pk', flat=True))
+  moved = MenuOption.objects.filter(pk__in=option_ids - nested_ids)\
+                            .update(menu_group=menu_group, parent=parent)
+  if descendant_ids | nested_ids:
+    MenuOption.objects.filter(pk__in=descendant_ids | nested_ids)\
+                      .update(menu_group=menu_group)
+  for group_id in group_ids | set([menu_group.pk]):
+    bump_menu_version(group_id)
+  return moved
+
+@transaction.commit_on_success
+def _set_menu_option_visibility(option_ids, flags):
+  """Helper function to change who options are shown to inside a transaction.
+
+  Keyword arguments:
+  option_ids -- The ids of the options to change.
+  flags -- The values to set.
+
+  """
+
+  options = MenuOption.objects.filter(pk__in=option_ids)
+  group_ids = set(options.values_list('menu_group', flat=True))
+  changed = options.update(**flags)
+  for group_id in group_ids:
+    bump_menu_version(group_id)
+  return changed
@@ -0,0 +1,301 @@
+"""
+Version counters for gdt_nav menu data.
+
+Each menu group has a version number held in the django cache which is bumped
+whenever anything that could alter the group's menu changes (see the signal
+hooks at the bottom of gdt_nav.models).  There is also a global version that
+is bumped whenever any menu changes.  Anything caching menu data (rendered
+menus, ETags, snapshots etc.) can include the version in its key rather than
+having to work out for itself whether the data is stale.  Models also have
+version numbers which are used to key the cached results of model menu
+options, and users' permissions have a version which is used to key the
+cached permissions of each user.
+
+For the versions to be of any use across processes a shared cache backend
+(e.g. memcached) must be configured.
+
+When menus are read from a replica database (see gdt_nav.routers) bumping a
+version also records that the data has recently changed, so that reads go to
+the primary database until the replica has caught up.  Otherwise a process
+could see the new version but build its cached data from the replica's old
+data and keep it until the next change.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# The prefix used for all version keys in the cache.
+VERSION_KEY_PREFIX = 'gdt_nav:version:'
+
+# The key suffix used for the global version.
+GLOBAL_VERSION = 'all'
+
+# The key suffix used for the version of users' permissions.
+PERMISSION_VERSION = 'permissions'
+
+# How long version counters should be kept in the cache for.
+VERSION_TIMEOUT = getattr(settings, 'GDT_NAV_VERSION_TIMEOUT',
+                          60 * 60 * 24 * 30)
+
+# The prefix used for the keys recording recent changes in the cache.
+CHANGED_KEY_PREFIX = 'gdt_nav:changed:'
+
+# The number of seconds after data changes that a replica database may still
+# be serving the old data.
+REPLICA_LAG = getattr(settings, 'GDT_NAV_REPLICA_LAG', 10)
+
+# Per-thread storage for bumps that have been deferred.
+_state = threading.local()
+
+
+def get_menu_version(group_id=None):
+  """Return the current version number of a menu group's data.
+
+  Keyword arguments:
+  group_id -- The id of the menu group to fetch the version of, or None for
+              the global version (default None).
+
+  """
+
+  return _get_version(_version_key(group_id))
+
+def get_menu_versions(group_ids):
+  """Return the current version numbers for several menu groups at once.
+
+  Keyword arguments:
+  group_ids -- The ids of the menu groups to fetch the versions of.
+
+  Returns:
+  A dictionary mapping each group id to its version number.
+
+  """
+
+  keys = dict([(_version_key(group_id), group_id) for group_id in group_ids])
+  cached = cache.get_many(keys.keys())
+  versions = {}
+  for key, group_id in keys.items():
+    if key in cached:
+      versions[group_id] = cached[key]
+    else:
+      versions[group_id] = get_menu_version(group_id)
+  return versions
+
+def bump_menu_version(group_id=None):
+  """Mark a menu group's data (or all menu data) as having changed.
+
+  If bumps are currently being deferred (see defer_menu_version_bumps) then
+  the bump will be recorded and applied once they are flushed.
+
+  Keyword arguments:
+  group_id -- The id of the menu group that has changed, or None if every
+              menu group should be treated as having changed (default None).
+
+  """
+
+  deferred = getattr(_state, 'deferred', None)
+  if deferred is not None:
+    deferred.add(('menu', group_id))
+    return
+  # Record the change first so that anything seeing the new version also
+  # knows to avoid the replica.
+  _mark_changed(_version_key(None))
+  if group_id is None:
+    from gdt_nav.models import MenuGroup
+    for pk in MenuGroup.objects.values_list('pk', flat=True):
+      _increment(_version_key(pk))
+  else:
+    _increment(_version_key(group_id))
+  _increment(_version_key(None))
+
+def get_model_version(model):
+  """Return the current version number of the data of a model.
+
+  Model versions are used to key the cached results of model menu options,
+  they are only bumped when GDT_NAV_MODEL_CACHE_INVALIDATION is True.
+
+  Keyword arguments:
+  model -- The model class.
+
+  """
+
+  return _get_version(_model_version_key(model))
+
+def bump_model_version(model):
+  """Mark the data of a model as having changed.
+
+  Deferred along with menu version bumps (see defer_menu_version_bumps).
+
+  Keyword arguments:
+  model -- The model class.
+
+  """
+
+  deferred = getattr(_state, 'deferred', None)
+  if deferred is not None:
+    deferred.add(('model', model))
+    return
+  _mark_changed(_model_version_key(model))
+  _increment(_model_version_key(model))
+
+def get_permission_version():
+  """Return the current version number of the permissions assigned to users.
+
+  """
+
+  return _get_version(_version_key(PERMISSION_VERSION))
+
+def bump_permission_version():
+  """Mark the permissions assigned to users (or their groups) as changed.
+
+  Deferred along with menu version bumps (see defer_menu_version_bumps).
+
+  """
+
+  deferred = getattr(_state, 'deferred', None)
+  if deferred is not None:
+    deferred.add(('permissions', None))
+    return
+  _increment(_version_key(PERMISSION_VERSION))
+
+def recently_changed(model=None):
+  """Return whether data may have changed too recently for a replica to have.
+
+  Keyword arguments:
+  model -- The model class to check, or None to check the menu data
+           (default None).
+
+  """
+
+  if model is None:
+    key = _version_key(None)
+  else:
+    key = _model_version_key(model)
+  return cache.get(CHANGED_KEY_PREFIX + key) is not None
+
+def defer_menu_version_bumps():
+  """Start collecting version bumps for the current thread.
+
+  Bulk operations that make many changes should call this first and then call
+  flush_menu_version_bumps once they're done (ideally in a finally block) so
+  that each affected group is only invalidated once.  Bumps are deferred for
+  the whole of each request as well (see the signal hooks at the bottom of
+  gdt_nav.models) so that they're applied after the request's changes have
+  been committed, otherwise another request could cache the old data under
+  the new version.  Calls may be nested, the bumps are applied once every
+  call has been matched by a flush.
+
+  """
+
+  if getattr(_state, 'deferred', None) is None:
+    _state.deferred = set()
+    _state.depth = 0
+  _state.depth += 1
+
+def flush_menu_version_bumps(all_levels=False):
+  """Stop deferring version bumps and apply any that were collected.
+
+  Keyword arguments:
+  all_levels -- Whether to apply the bumps even if there are outer calls to
+                defer_menu_version_bumps that haven't been flushed yet
+                (default False).
+
+  """
+
+  deferred = getattr(_state, 'deferred', None)
+  if deferred is None:
+    return
+  _state.depth -= 1
+  if _state.depth > 0 and not all_levels:
+    return
+  _state.deferred = None
+  if ('menu', None) in deferred:
+    bump_menu_version()
+  for kind, target in deferred:
+    if kind == 'menu' and ('menu', None) not in deferred:
+      bump_menu_version(target)
+    elif kind == 'model':
+      bump_model_version(target)
+    elif kind == 'permissions':
+      bump_permission_version()
+
+def _version_key(group_id):
+  """Helper function to generate the cache key for a version counter.
+
+  Keyword arguments:
+  group_id -- The id of the menu group, or None for the global version.
+
+  """
+
+  if group_id is None:
+    group_id = GLOBAL_VERSION
+  return '%s%s' % (VERSION_KEY_PREFIX, group_id)
+
+def _model_version_key(model):
+  """Helper function to generate the cache key for a model's version counter.
+
+  Keyword arguments:
+  model -- The model class.
+
+  """
+
+  return '%smodel:%s.%s' % (VERSION_KEY_PREFIX, model._meta.app_label,
+                            model._meta.object_name.lower())
+
+def _mark_changed(key):
+  """Helper function to record that the data behind a version has changed.
+
+  Only recorded when menus are read from a replica database.
+
+  Keyword arguments:
+  key -- The cache key of the version counter.
+
+  """
+
+  if getattr(settings, 'GDT_NAV_READ_DATABASE', None) is not None \
+    and REPLICA_LAG:
+    cache.set(CHANGED_KEY_PREFIX + key, True, REPLICA_LAG)
+
+def _get_version(key):
+  """Helper function to fetch a version counter from the cache.
+
+  Keyword arguments:
+  key -- The cache key of the counter.
+
+  """
+
+  version = cache.get(key)
+  if version is None:
+    # Start the counter off at the current time rather than 0 so that a
+    # counter which has fallen out of the cache never goes backwards.
+    cache.add(key, _initial_version(), VERSION_TIMEOUT)
+    version = cache.get(key)
+    if version is None:
+      # The cache isn't storing anything (e.g. the dummy backend) so there's
+      # no way to know if anything has changed, assume that it has.
+      version = _initial_version()
+  return version
+
+def _initial_version():
+  """Helper function to generate the starting value for a version counter.
+
+  """
+
+  return int(time.time() * 1000)
+
+def _increment(key):
+  """Helper function to increment a version counter in the cache.
+
+  Keyword arguments:
+  key -- The cache key of the counter.
+
+  """
+
+  try:
+    cache.incr(key)
+  except ValueError, e:
+    # The counter isn't in the cache, start a new one (which will be greater
+    # than any previous value).
+    cache.set(key, _initial_version(), VERSION_TIMEOUT)
@@ -0,0 +1,337 @@
+"""
+Precompilation of static menu groups.
+
+A menu group is static if every option in it is an absolute url option or a
+named url option whose url takes no arguments, and none of its options have
+permissions attached.  The menu produced for a static group depends only on
+the type of user viewing it (anonymous, authenticated or staff) and which of
+its options is selected, so every possible menu can be rendered up front.
+Rendering a compiled group is then a case of resolving the current url and
+looking the html up without touching the database.
+
+Compiled groups are stored in the django cache (and in a per-process
+dictionary) along with the version of the menu data they were compiled from
+so they are recompiled as soon as the group changes.  Compiled groups are
+used by the menu_as_* template tags when either the GDT_NAV_USE_COMPILED_MENUS
+setting is True, in which case groups need compiling with the compilemenus
+management command (e.g. at deploy time), or the GDT_NAV_COMPILE_MENUS setting
+is True, in which case groups are also compiled automatically the first time
+they are rendered.  Compiled groups are shared between the processes on a
+host as well when GDT_NAV_SNAPSHOT_DIR is set (see gdt_nav.snapshots).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import get_resolver, reverse, NoReverseMatch
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language
+from gdt_nav.cache import get_menu_version, VERSION_TIMEOUT
+from gdt_nav.matching import AbsoluteUrlIndex, path_depth, \
+                             prefix_matching_enabled
+from gdt_nav.models import MenuGroup, MenuOption
+from gdt_nav.snapshots import read_snapshot, write_snapshot
+
+
+# The prefix used for the cache keys of compiled groups.
+COMPILED_KEY_PREFIX = 'gdt_nav:compiled:'
+
+# The group and item tags to render compiled menus for, other combinations
+# will be rendered dynamically.
+COMPILED_TAGS = getattr(settings, 'GDT_NAV_COMPILED_TAGS',
+                        (('ul', 'li'), ('div', 'div')))
+
+# The types of user that see different versions of a menu.
+AUDIENCES = ('anonymous', 'authenticated', 'staff')
+
+# Per-process store of compiled groups, keyed in the same way as the cache.
+_compiled_menus = {}
+
+
+class CompiledMenu(object):
+  """The prerendered menus of a menu group.
+
+  """
+
+  def __init__(self, group_id, version, static, reason=None):
+    """Create an empty compiled menu.
+
+    Keyword arguments:
+    group_id -- The id of the menu group that was compiled.
+    version -- The menu data version the group was compiled from.
+    static -- Whether the menu group is static, if not then the compiled menu
+              just records that it needs to be rendered dynamically.
+    reason -- Why the menu group isn't static (default None).
+
+    """
+
+    self.group_id = group_id
+    self.version = version
+    self.static = static
+    self.reason = reason
+    # Maps (audience, selected option id) to a dictionary mapping
+    # (group_tag, item_tag) to the rendered menu.
+    self.variants = {}
+    # Maps audiences to dictionaries mapping url names to a tuple of
+    # (position in menu, option id) for the option that should be selected on
+    # that url.
+    self.url_name_index = {}
+    # Maps audiences to an AbsoluteUrlIndex of the absolute url options that
+    # can be selected.
+    self.url_index = {}
+    # Maps the ids of options that can be selected to their position in the
+    # menu.
+    self.positions = {}
+
+  def render(self, request, group_tag, item_tag, url_parts=None):
+    """Return the prerendered menu for a request.
+
+    Keyword arguments:
+    request -- The request to render the menu for.
+    group_tag -- The tag to surround collections of menu items with.
+    item_tag -- The tag to surround individual menu items with.
+    url_parts -- The result of MenuGroup._fetch_current_url_parts for the
+                 request if it has already been calculated (default None).
+
+    Returns:
+    The rendered menu, or None if it needs to be rendered dynamically.
+
+    """
+
+    if not self.static or (group_tag, item_tag) not in COMPILED_TAGS:
+      return None
+    if url_parts is None:
+      url_parts = MenuGroup._fetch_current_url_parts(request)
+    url, url_name, url_kwargs = url_parts
+    audience = request_audience(request)
+    # The option that matched the most of the url is selected, with the one
+    # that comes first in the menu winning any ties.
+    full_depth = path_depth(url)
+    matches = []
+    named_match = self.url_name_index[audience].get(url_name)
+    if named_match is not None:
+      matches.append((-full_depth,) + named_match)
+    absolute_matches = self.url_index[audience].match(url,
+                                                      prefix_matching_enabled())
+    for option_id, depth in absolute_matches.items():
+      matches.append((-depth, self.positions[option_id], option_id))
+    selected_id = None
+    if matches:
+      selected_id = min(matches)[2]
+    return self.variants[(audience, selected_id)][(group_tag, item_tag)]
+
+
+def request_audience(request):
+  """Return the type of user a request was made by.
+
+  Keyword arguments:
+  request -- The request to check.
+
+  """
+
+  user = request.user
+  if user.is_anonymous():
+    return 'anonymous'
+  elif user.is_staff:
+    return 'staff'
+  return 'authenticated'
+
+def compiled_menus_enabled():
+  """Return whether compiled menus should be used when rendering.
+
+  """
+
+  return getattr(settings, 'GDT_NAV_USE_COMPILED_MENUS', False) \
+    or getattr(settings, 'GDT_NAV_COMPILE_MENUS', False)
+
+def get_compiled_menu(menu_group):
+  """Fetch the compiled version of a menu group.
+
+  If there's no up to date compiled version and GDT_NAV_COMPILE_MENUS is set
+  then the group will be compiled.
+
+  Keyword arguments:
+  menu_group -- The menu group or the name of the menu group.
+
+  Returns:
+  The CompiledMenu for the group (which may record that the group isn't
+  static), or None if the group hasn't been compiled.
+
+  """
+
+  if isinstance(menu_group, MenuGroup):
+    name = menu_group.name
+  else:
+    name = menu_group
+  key = _compiled_key(name)
+  compiled = _current_compiled_menu(_compiled_menus.get(key), menu_group)
+  if compiled is None:
+    # Another process on this host may have compiled the group already (or
+    # recompiled it since this process last looked).
+    compiled = _current_compiled_menu(read_snapshot(key), menu_group)
+  if compiled is None:
+    compiled = _current_compiled_menu(cache.get(key), menu_group)
+    if compiled is not None:
+      write_snapshot(key, compiled)
+  if compiled is None and getattr(settings, 'GDT_NAV_COMPILE_MENUS', False):
+    if not isinstance(menu_group, MenuGroup):
+      try:
+        menu_group = MenuGroup.objects.get(name=menu_group)
+      except (MenuGroup.DoesNotExist, MenuGroup.MultipleObjectsReturned), e:
+        return None
+    compiled = compile_menu_group(menu_group)
+  if compiled is not None:
+    _compiled_menus[key] = compiled
+  else:
+    _compiled_menus.pop(key, None)
+  return compiled
+
+def compile_menu_group(menu_group):
+  """Compile a menu group and store the result.
+
+  Keyword arguments:
+  menu_group -- The menu group to compile.
+
+  Returns:
+  The CompiledMenu for the group.
+
+  """
+
+  # Grab the version first so that any change made whilst compiling causes
+  # the group to be compiled again.
+  version = get_menu_version(menu_group.pk)
+  options = menu_group.load_tree().nodes
+
+  reason = _non_static_reason(options)
+  if reason is None:
+    compiled = CompiledMenu(menu_group.pk, version, True)
+    for position, option in enumerate(options):
+      compiled.positions[option.pk] = position
+    for audience in AUDIENCES:
+      _compile_audience(compiled, audience, options)
+  else:
+    compiled = CompiledMenu(menu_group.pk, version, False, reason)
+  key = _compiled_key(menu_group.name)
+  cache.set(key, compiled, VERSION_TIMEOUT)
+  _compiled_menus[key] = compiled
+  write_snapshot(key, compiled)
+  return compiled
+
+def _current_compiled_menu(compiled, menu_group):
+  """Helper function to check that a compiled menu group is up to date.
+
+  Keyword arguments:
+  compiled -- The CompiledMenu, or None.
+  menu_group -- The menu group or the name of the menu group it should be for.
+
+  Returns:
+  The CompiledMenu, or None if it's for another group or out of date.
+
+  """
+
+  if compiled is None:
+    return None
+  if isinstance(menu_group, MenuGroup) and compiled.group_id != menu_group.pk:
+    return None
+  if compiled.version != get_menu_version(compiled.group_id):
+    return None
+  return compiled
+
+def _compiled_key(name):
+  """Helper function to generate the cache key for a compiled menu group.
+
+  Keyword arguments:
+  name -- The name of the menu group.
+
+  """
+
+  return '%s%s:%s:%s' % (COMPILED_KEY_PREFIX, getattr(settings, 'SITE_ID', ''),
+                         get_language(),
+                         md5_constructor(smart_str(name)).hexdigest())
+
+def _non_static_reason(options):
+  """Helper function to check whether a list of options is static.
+
+  Keyword arguments:
+  options -- The menu nodes to check.
+
+  Returns:
+  None if the options are static, otherwise a description of why not.
+
+  """
+
+  resolver = get_resolver(None)
+  for option in options:
+    if option.option_type == MenuOption.MODEL_MENU_OPTION:
+      return "'%s' is a model menu option" % option.name
+    elif option.option_type == MenuOption.NAMED_URL_MENU_OPTION:
+      try:
+        if resolver.reverse_dict[option.url_name][0][0][1]:
+          return "'%s' has a url that takes arguments" % option.name
+        reverse(option.url_name)
+      except (KeyError, NoReverseMatch), e:
+        return "'%s' has a url that can't be reversed" % option.name
+    if option.permissions:
+      return "options have permissions"
+  return None
+
+def _compile_audience(compiled, audience, options):
+  """Helper function to render every variant of a menu for a type of user.
+
+  This follows the same rules as MenuGroup.generate_hierarchy for deciding
+  which options can be seen and selected.
+
+  Keyword arguments:
+  compiled -- The CompiledMenu to add the variants to.
+  audience -- The type of user to render the menu for.
+  options -- The (static) menu nodes of the menu group.
+
+  """
+
+  from gdt_nav.templatetags.menu_tags import _generate_menu_string
+
+  if audience == 'anonymous':
+    visible = [option for option in options if option.show_to_anonymous]
+  elif audience == 'staff':
+    visible = [option for option in options
+               if option.show_to_authenticated or option.show_to_staff]
+  else:
+    visible = [option for option in options if option.show_to_authenticated]
+  options_by_id = dict([(option.pk, option) for option in visible])
+
+  compiled.url_name_index[audience] = {}
+  compiled.url_index[audience] = AbsoluteUrlIndex()
+  selections = [(None, {})]
+  for option in visible:
+    # Work out the ancestors of the option, it can only be selected if they're
+    # all visible.
+    selected_items = {option: True}
+    parent_id = option.parent_id
+    while parent_id is not None and parent_id in options_by_id:
+      parent = options_by_id[parent_id]
+      selected_items[parent] = False
+      parent_id = parent.parent_id
+    if parent_id is not None:
+      continue
+    selections.append((option.pk, selected_items))
+    if option.option_type == MenuOption.NAMED_URL_MENU_OPTION:
+      if option.url_name not in compiled.url_name_index[audience]:
+        compiled.url_name_index[audience][option.url_name] = \
+          (compiled.positions[option.pk], option.pk)
+    else:
+      compiled.url_index[audience].add(option.url, option.pk)
+
+  for selected_id, selected_items in selections:
+    hierarchies = {'ROOT': []}
+    for option in selected_items:
+      hierarchies[option] = []
+    for option in visible:
+      if option.parent_id is None:
+        hierarchies['ROOT'].append(option)
+      elif option.parent_id in options_by_id \
+        and options_by_id[option.parent_id] in selected_items:
+        hierarchies[options_by_id[option.parent_id]].append(option)
+    variants = {}
+    for group_tag, item_tag in COMPILED_TAGS:
+      variants[(group_tag, item_tag)] = _generate_menu_string(
+        hierarchies, "ROOT", selected_items, {}, group_tag, item_tag)
+    compiled.variants[(audience, selected_id)] = variants
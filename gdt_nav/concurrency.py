@@ -0,0 +1,310 @@
+"""
+Running menu generation work in background threads.
+
+There's no event loop for menu generation to cooperate with, so work that
+would otherwise block the caller (fetching a group's options, looking up
+permissions, evaluating the querysets of model menu options) is handed to a
+background thread and a MenuFuture is returned straight away.  The caller can
+carry on with other work (e.g. start on the other menus of a page) and then
+collect the result when it's needed.
+
+The independent queries made while generating a menu are run on a pool of
+worker threads shared by the whole process, the size of which is set by the
+GDT_NAV_CONCURRENCY_WORKERS setting (default 4).  If the
+GDT_NAV_CONCURRENT_QUERIES setting is True then menus rendered by the
+template tags use the pool as well.
+
+Each background thread uses its own database connection.  Connections of
+threads started for a single piece of work are closed when it's finished,
+the worker threads of the pool end any transaction after each piece of work
+and close their connections once there's no more work waiting.  Either way
+the work can't see any changes the calling thread has made inside a
+transaction that hasn't been committed yet.
+"""
+import Queue
+import sys
+import threading
+
+from django.conf import settings
+from django.core.urlresolvers import get_script_prefix, get_urlconf, \
+                                     set_script_prefix, set_urlconf
+from django.db import connections, transaction
+from django.utils import translation
+
+
+# The process wide pool of worker threads, created when first needed.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class MenuTimeoutError(Exception):
+  """Raised when the result of a MenuFuture isn't ready in time.
+
+  """
+  pass
+
+
+class MenuFuture(object):
+  """The result of some work running in a background thread.
+
+  """
+
+  def __init__(self):
+    """Create a future that hasn't finished yet.
+
+    """
+
+    self._finished = threading.Event()
+    self._result = None
+    self._exc_info = None
+    self._callbacks = []
+    self._lock = threading.Lock()
+
+  def done(self):
+    """Return whether the work has finished.
+
+    """
+
+    return self._finished.isSet()
+
+  def result(self, timeout=None):
+    """Wait for the work to finish and return its result.
+
+    If the work raised an exception then it is raised again here.
+
+    Keyword arguments:
+    timeout -- The number of seconds to wait for, or None to wait for as long
+               as it takes (default None).
+
+    """
+
+    self._finished.wait(timeout)
+    if not self.done():
+      raise MenuTimeoutError("The menu wasn't generated within %s seconds." %
+                             timeout)
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+  def add_done_callback(self, callback):
+    """Arrange for a function to be called once the work has finished.
+
+    The callback is passed the future and is called in the background thread
+    (or straight away if the work has already finished).
+
+    Keyword arguments:
+    callback -- The function to call.
+
+    """
+
+    self._lock.acquire()
+    try:
+      if not self.done():
+        self._callbacks.append(callback)
+        return
+    finally:
+      self._lock.release()
+    callback(self)
+
+  def _finish(self, result=None, exc_info=None):
+    """Helper function to record the outcome of the work.
+
+    Keyword arguments:
+    result -- The value returned by the work (default None).
+    exc_info -- The sys.exc_info() of the exception raised by the work, if
+                any (default None).
+
+    """
+
+    self._lock.acquire()
+    try:
+      self._result = result
+      self._exc_info = exc_info
+      self._finished.set()
+      callbacks = self._callbacks
+      self._callbacks = []
+    finally:
+      self._lock.release()
+    for callback in callbacks:
+      callback(self)
+
+
+class MenuThreadPool(object):
+  """A fixed number of worker threads that run work in the order it arrives.
+
+  Work run on the pool must not wait for other work on the pool, otherwise
+  every worker could end up waiting for work that's never started.
+
+  """
+
+  def __init__(self, workers):
+    """Create a pool, the worker threads are started when work first arrives.
+
+    Keyword arguments:
+    workers -- The maximum number of worker threads.
+
+    """
+
+    self.workers = max(1, workers)
+    self._queue = Queue.Queue()
+    self._threads = []
+    self._lock = threading.Lock()
+
+  def submit(self, func, *args, **kwargs):
+    """Call a function on one of the pool's worker threads.
+
+    Keyword arguments:
+    func -- The function to call.
+    args -- The arguments to call the function with.
+    kwargs -- The keyword arguments to call the function with.
+
+    Returns:
+    A MenuFuture for the function's result.
+
+    """
+
+    future = MenuFuture()
+    self._start_workers()
+    self._queue.put((future, _thread_state(), func, args, kwargs))
+    return future
+
+  def _start_workers(self):
+    """Helper function to make sure all of the worker threads are running.
+
+    """
+
+    if len(self._threads) >= self.workers:
+      return
+    self._lock.acquire()
+    try:
+      while len(self._threads) < self.workers:
+        thread = threading.Thread(target=self._work)
+        thread.setDaemon(True)
+        thread.start()
+        self._threads.append(thread)
+    finally:
+      self._lock.release()
+
+  def _work(self):
+    """Helper function that runs work from the queue in a worker thread.
+
+    """
+
+    while True:
+      future, thread_state, func, args, kwargs = self._queue.get()
+      _run(future, thread_state, func, args, kwargs, False)
+      if self._queue.empty():
+        # Don't hold connections open whilst idle, the database may close
+        # them (e.g. MySQL's wait_timeout) before the next piece of work.
+        for conn in connections.all():
+          conn.close()
+
+
+def submit(func, *args, **kwargs):
+  """Call a function in a new background thread.
+
+  The thread uses the same language, script prefix and urlconf as the calling
+  thread so that links are generated in the same way.
+
+  Keyword arguments:
+  func -- The function to call.
+  args -- The arguments to call the function with.
+  kwargs -- The keyword arguments to call the function with.
+
+  Returns:
+  A MenuFuture for the function's result.
+
+  """
+
+  future = MenuFuture()
+  thread = threading.Thread(target=_run,
+                            args=(future, _thread_state(), func, args, kwargs))
+  thread.setDaemon(True)
+  thread.start()
+  return future
+
+def get_pool():
+  """Return the process wide MenuThreadPool, creating it if need be.
+
+  """
+
+  global _pool
+  if _pool is None:
+    _pool_lock.acquire()
+    try:
+      if _pool is None:
+        _pool = MenuThreadPool(getattr(settings, 'GDT_NAV_CONCURRENCY_WORKERS', 4))
+    finally:
+      _pool_lock.release()
+  return _pool
+
+def concurrent_queries_enabled():
+  """Return whether menus should make their queries concurrently by default.
+
+  """
+
+  return getattr(settings, 'GDT_NAV_CONCURRENT_QUERIES', False)
+
+def wait_all(futures, timeout=None):
+  """Wait for several futures and return their results.
+
+  Keyword arguments:
+  futures -- The futures to wait for.
+  timeout -- The number of seconds to wait for each future, or None to wait
+             for as long as it takes (default None).
+
+  Returns:
+  A list of the results in the same order as the futures.
+
+  """
+
+  return [future.result(timeout) for future in futures]
+
+def _thread_state():
+  """Helper function to capture the state a background thread should copy.
+
+  Returns:
+  A tuple of (language, script prefix, urlconf) for the current thread.
+
+  """
+
+  return (translation.get_language(), get_script_prefix(), get_urlconf())
+
+def _run(future, thread_state, func, args, kwargs, close_connections=True):
+  """Helper function that does the work of a future in its thread.
+
+  Keyword arguments:
+  future -- The MenuFuture to record the outcome in.
+  thread_state -- A tuple of (language, script prefix, urlconf) to use.
+  func -- The function to call.
+  args -- The arguments to call the function with.
+  kwargs -- The keyword arguments to call the function with.
+  close_connections -- Whether to close the thread's database connections
+                       afterwards rather than just ending their transactions
+                       (default True).
+
+  """
+
+  language, script_prefix, urlconf = thread_state
+  if language:
+    translation.activate(language)
+  set_script_prefix(script_prefix)
+  set_urlconf(urlconf)
+  result = None
+  exc_info = None
+  try:
+    try:
+      result = func(*args, **kwargs)
+    except:
+      exc_info = sys.exc_info()
+  finally:
+    if close_connections:
+      # Don't leave connections open from threads that are about to go away.
+      for conn in connections.all():
+        conn.close()
+    else:
+      # Make sure the next piece of work sees up to date data.
+      for alias in connections:
+        transaction.rollback_unless_managed(using=alias)
+    translation.deactivate()
+  future._finish(result, exc_info)
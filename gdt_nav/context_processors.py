@@ -0,0 +1,15 @@
+from django.conf import settings
+from gdt_nav.preload import preload_menus
+
+
+def menus(request):
+  """
+  Context processor that preloads the menu groups used on every page.
+
+  The names of the groups are taken from the GDT_NAV_PRELOAD_MENUS setting.
+
+  """
+  names = getattr(settings, 'GDT_NAV_PRELOAD_MENUS', ())
+  if names:
+    preload_menus(request, names)
+  return {}
@@ -3,7 +3,7 @@ from django import forms
 from django.utils.safestring import mark_safe
 from django.contrib.auth.models import Permission
 from django.contrib.admin import widgets as admin_widgets
-from models import MenuOption
+from models import MenuGroup, MenuOption, nullable_ordering_fields
 
 class MenuOptionWidget(forms.HiddenInput):
     def render(self, name, value, attrs=None):
@@ -33,7 +33,9 @@ class AbsoluteMenuOptionForm(MenuOptionForm):
 
     class Meta(MenuOptionForm.Meta):
         exclude = ['url_name','content_type','manager','query',
-                   'url_id','model_id','order_by','result_limit']
+                   'url_id','model_id','order_by','result_limit',
+                   'label_field','select_related','cache_timeout',
+                   'paginate']
 
 class NamedMenuOptionForm(MenuOptionForm):
     def __init__(self, *args, **kwargs):
@@ -45,7 +47,9 @@ class NamedMenuOptionForm(MenuOptionForm):
 
     class Meta(MenuOptionForm.Meta):
         exclude = ['url','content_type','manager','query',
-                   'url_id','model_id','order_by','result_limit']
+                   'url_id','model_id','order_by','result_limit',
+                   'label_field','select_related','cache_timeout',
+                   'paginate']
 
 class ModelMenuOptionForm(MenuOptionForm):
     def __init__(self, *args, **kwargs):
@@ -67,6 +71,36 @@ class ModelMenuOptionForm(MenuOptionForm):
         self.fields['order_by'].help_text = """Any sorting to be done on the query - format is as if entering directly into a django order_by filter, comma separate multiple order keys - will happen after filtering."""
         #self.fields['result_limit'].required = True
         self.fields['result_limit'].help_text = """Number of results to return."""
+        self.fields['label_field'].help_text = """The field to use as the text of each result - format is as if entering directly into a django values_list, use __ to follow relations - if empty the result itself will be used."""
+        self.fields['select_related'].help_text = """Any related objects to fetch along with the results - format is as if entering directly into a django select_related, comma separate multiple relations."""
+        self.fields['cache_timeout'].help_text = """Number of seconds to cache the results for, the cached results are shared by all users so the query must not depend on who is viewing the menu."""
+        self.fields['paginate'].help_text = """Whether to follow the results with a 'more...' link to the next page of results when there are more than the result limit, the order_by fields should be indexed and can't allow nulls."""
+
+    def clean(self):
+        content_type = self.cleaned_data.get('content_type')
+        if self.cleaned_data.get('paginate') and content_type is not None:
+            ordering = MenuOption(order_by=self.cleaned_data.get('order_by'),
+                                  paginate=True)._ordering()
+            nullable = nullable_ordering_fields(content_type.model_class(),
+                                                ordering)
+            if nullable:
+                raise forms.ValidationError("Paginated results can't be ordered by fields that allow nulls: %s." % ', '.join(nullable))
+        return self.cleaned_data
 
     class Meta(MenuOptionForm.Meta):
         exclude = ['url']
+
+class MoveMenuOptionsForm(forms.Form):
+    menu_group = forms.ModelChoiceField(queryset=MenuGroup.objects.order_by('name'),
+                                        help_text="""The menu group to move the options (and their sub-menus) to.""")
+    parent = forms.ModelChoiceField(queryset=MenuOption.objects.order_by('menu_group', 'name'),
+                                    required=False,
+                                    help_text="""The option to move the options under, which must be in the menu group above - leave empty to move them to the top of the menu.""")
+
+    def clean(self):
+        menu_group = self.cleaned_data.get('menu_group')
+        parent = self.cleaned_data.get('parent')
+        if menu_group is not None and parent is not None \
+          and parent.menu_group_id != menu_group.pk:
+            raise forms.ValidationError("The parent must be in the chosen menu group.")
+        return self.cleaned_data
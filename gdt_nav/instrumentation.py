@@ -0,0 +1,132 @@
+"""
+Timing and query count instrumentation for menu rendering.
+
+When the GDT_NAV_INSTRUMENTATION setting is True each menu rendered by the
+menu_as_* template tags is timed.  The results are sent out with the
+gdt_nav.signals.menu_rendered signal, logged to the 'gdt_nav' logger at debug
+level and stored on the request so that MenuTimingMiddleware can report them
+in a response header.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from gdt_nav.signals import menu_rendered
+
+
+# The attribute of the request that timings are stored in.
+REQUEST_TIMINGS = '_gdt_nav_timings'
+
+logger = logging.getLogger('gdt_nav')
+
+# Per-thread storage for the timer of the menu currently being rendered.
+_state = threading.local()
+
+
+def instrumentation_enabled():
+  """Return whether menu rendering should be instrumented.
+
+  """
+
+  return getattr(settings, 'GDT_NAV_INSTRUMENTATION', False)
+
+def record_cache_hit():
+  """Note that a cache was used whilst rendering the current menu.
+
+  """
+
+  timer = getattr(_state, 'timer', None)
+  if timer is not None:
+    timer.cache_hits += 1
+
+
+class MenuTimer(object):
+  """Times the stages of rendering a single menu.
+
+  If instrumentation is disabled then all methods do nothing.
+
+  """
+
+  def __init__(self, request=None):
+    """Start timing a menu.
+
+    Keyword arguments:
+    request -- The request the menu is being rendered for (default None).
+
+    """
+
+    self.enabled = instrumentation_enabled()
+    self.request = request
+    self.timings = {}
+    self.cache_hits = 0
+    self.queries = 0
+    self._stage = None
+    if not self.enabled:
+      return
+    _state.timer = self
+    # Queries are only recorded by django when DEBUG is on unless the debug
+    # cursor is forced.
+    self._connections = []
+    for conn in connections.all():
+      self._connections.append((conn, conn.use_debug_cursor,
+                                len(conn.queries)))
+      conn.use_debug_cursor = True
+    self._stage_start = time.time()
+
+  def stage(self, name):
+    """Finish timing the current stage (if any) and start timing a new one.
+
+    Keyword arguments:
+    name -- The name of the new stage.
+
+    """
+
+    if not self.enabled:
+      return
+    now = time.time()
+    if self._stage is not None:
+      self.timings[self._stage] = now - self._stage_start
+    self._stage = name
+    self._stage_start = now
+
+  def finish(self, menu_group):
+    """Finish timing the menu and report the results.
+
+    Keyword arguments:
+    menu_group -- The menu group that was rendered, or its name if it couldn't
+                  be found.
+
+    """
+
+    if not self.enabled:
+      return
+    self.stage(None)
+    _state.timer = None
+    for conn, use_debug_cursor, query_count in self._connections:
+      self.queries += len(conn.queries) - query_count
+      conn.use_debug_cursor = use_debug_cursor
+      if not settings.DEBUG:
+        # Don't let the recorded queries build up.
+        del conn.queries[query_count:]
+
+    if self.request is not None:
+      if not hasattr(self.request, REQUEST_TIMINGS):
+        setattr(self.request, REQUEST_TIMINGS, [])
+      getattr(self.request, REQUEST_TIMINGS).append((unicode(menu_group), self))
+    logger.debug("Rendered menu %s in %.2fms (%s) with %d queries and %d cache hits",
+                 menu_group, self.total() * 1000,
+                 ', '.join(['%s %.2fms' % (stage, seconds * 1000)
+                            for stage, seconds in sorted(self.timings.items())]),
+                 self.queries, self.cache_hits)
+    menu_rendered.send(sender=self.__class__, menu_group=menu_group,
+                       request=self.request, timings=self.timings,
+                       queries=self.queries, cache_hits=self.cache_hits)
+
+  def total(self):
+    """Return the total time in seconds taken to render the menu.
+
+    """
+
+    return sum(self.timings.values())
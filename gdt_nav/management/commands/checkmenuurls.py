@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from gdt_nav.matching import get_url_requirements
+from gdt_nav.models import MenuGroup, MenuOption
+
+
+class Command(BaseCommand):
+  help = "Report named url and model menu options whose url name can never be reversed (all groups are checked if none are named)."
+  args = '[menu group name ...]'
+
+  def handle(self, *args, **options):
+    menu_groups = MenuGroup.objects.order_by('name')
+    if args:
+      menu_groups = menu_groups.filter(name__in=args)
+      missing = set(args) - set([menu_group.name for menu_group in menu_groups])
+      if missing:
+        raise CommandError("Unknown menu groups: %s" % ', '.join(sorted(missing)))
+    verbosity = int(options.get('verbosity', 1))
+    problems = 0
+    for menu_group in menu_groups:
+      menu_options = menu_group.menu_items\
+                       .exclude(option_type=MenuOption.ABSOLUTE_URL_MENU_OPTION)\
+                       .order_by('ordering')
+      for menu_option in menu_options:
+        if not get_url_requirements(menu_option.url_name):
+          problems += 1
+          if verbosity > 0:
+            self.stdout.write("'%s': option '%s' (%s) uses unknown url name '%s'.\n" %
+                              (menu_group.name, menu_option.name,
+                               menu_option.get_option_type_display(),
+                               menu_option.url_name))
+    if verbosity > 0:
+      self.stdout.write("%d option(s) can't be generated.\n" % problems)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from gdt_nav.compiler import compile_menu_group
+from gdt_nav.models import MenuGroup
+
+
+class Command(BaseCommand):
+  help = "Prerender static menu groups so they can be displayed without any database access (all groups are compiled if none are named)."
+  args = '[menu group name ...]'
+
+  def handle(self, *args, **options):
+    menu_groups = MenuGroup.objects.order_by('name')
+    if args:
+      menu_groups = menu_groups.filter(name__in=args)
+      missing = set(args) - set([menu_group.name for menu_group in menu_groups])
+      if missing:
+        raise CommandError("Unknown menu groups: %s" % ', '.join(sorted(missing)))
+    verbosity = int(options.get('verbosity', 1))
+    for menu_group in menu_groups:
+      compiled = compile_menu_group(menu_group)
+      if verbosity > 0:
+        if compiled.static:
+          print "Compiled '%s' (%d variants)." % (menu_group.name,
+                                                  len(compiled.variants))
+        else:
+          print "Skipped '%s': %s." % (menu_group.name, compiled.reason)
@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+from gdt_nav.backup import dump_menu_group
+from gdt_nav.models import MenuGroup
+
+
+class Command(BaseCommand):
+  option_list = BaseCommand.option_list + (
+    make_option('--indent', default=None, dest='indent', type='int',
+                help='Specifies the indent level to use when pretty-printing output'),
+  )
+  help = "Output a menu group and all of its options as JSON."
+  args = '<menu group name>'
+
+  def handle(self, *args, **options):
+    if len(args) != 1:
+      raise CommandError("Please specify the name of a single menu group.")
+    try:
+      menu_group = MenuGroup.objects.get(name=args[0])
+    except MenuGroup.DoesNotExist, e:
+      raise CommandError("Unknown menu group: %s" % args[0])
+    self.stdout.write(simplejson.dumps(dump_menu_group(menu_group),
+                                       indent=options.get('indent')))
+    self.stdout.write('\n')
@@ -0,0 +1,26 @@
+from __future__ import with_statement
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+from gdt_nav.backup import load_menu_group, MenuLoadError
+
+
+class Command(BaseCommand):
+  help = "Load a menu group from a JSON file produced by dumpmenugroup, replacing the options of any existing group with the same name."
+  args = '<file>'
+
+  def handle(self, *args, **options):
+    if len(args) != 1:
+      raise CommandError("Please specify a single file to load.")
+    try:
+      with open(args[0]) as menu_file:
+        data = simplejson.load(menu_file)
+    except (IOError, ValueError), e:
+      raise CommandError("Unable to read %s: %s" % (args[0], e))
+    try:
+      menu_group = load_menu_group(data)
+    except MenuLoadError, e:
+      raise CommandError(str(e))
+    if int(options.get('verbosity', 1)) > 0:
+      self.stdout.write("Loaded %d options into menu group '%s'.\n" %
+                        (menu_group.menu_items.count(), menu_group.name))
@@ -0,0 +1,76 @@
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import Resolver404
+from django.test.client import RequestFactory
+from gdt_nav.compiler import compile_menu_group, compiled_menus_enabled
+from gdt_nav.matching import get_absolute_url_index, get_url_requirements
+from gdt_nav.models import MenuGroup
+from gdt_nav.templatetags.menu_tags import render_menu
+
+
+class Command(BaseCommand):
+  option_list = BaseCommand.option_list + (
+    make_option('--path', action='append', default=[], dest='paths',
+                help='A path to render the menus for, may be given more than once (default /).'),
+  )
+  help = "Load, index and render menu groups for each type of user so that the caches are warm before any requests arrive (all groups are warmed if none are named).  Menus are warmed for the current site, run the command with each site's settings to warm them all."
+  args = '[menu group name ...]'
+
+  def handle(self, *args, **options):
+    menu_groups = MenuGroup.objects.order_by('name')
+    if args:
+      menu_groups = menu_groups.filter(name__in=args)
+      missing = set(args) - set([menu_group.name for menu_group in menu_groups])
+      if missing:
+        raise CommandError("Unknown menu groups: %s" % ', '.join(sorted(missing)))
+    verbosity = int(options.get('verbosity', 1))
+    paths = options.get('paths') or ['/']
+    host = 'localhost'
+    if Site._meta.installed:
+      host = Site.objects.get_current().domain
+    for menu_group in menu_groups:
+      start = time.time()
+      tree = menu_group.load_tree()
+      get_absolute_url_index(menu_group, tree)
+      for node in tree.nodes:
+        if node.url_name:
+          get_url_requirements(node.url_name)
+      if compiled_menus_enabled():
+        compile_menu_group(menu_group)
+      renders = 0
+      skipped = set()
+      for audience, user in _audience_users():
+        for path in paths:
+          request = RequestFactory().get(path, HTTP_HOST=host)
+          request.user = user
+          try:
+            render_menu(request, menu_group)
+            renders += 1
+          except Resolver404, e:
+            skipped.add(path)
+      if verbosity > 0:
+        for path in sorted(skipped):
+          print "Skipped %s: no view for the path." % path
+        print "Warmed '%s' in %.1fms (%d options, %d renders)." % \
+              (menu_group.name, (time.time() - start) * 1000,
+               len(tree.nodes), renders)
+
+def _audience_users():
+  """Helper function to generate a user of each type without any permissions.
+
+  The users aren't saved, their permission caches are filled in so that
+  checking their permissions doesn't touch the database.
+
+  """
+
+  users = [('anonymous', AnonymousUser())]
+  for audience, is_staff in (('authenticated', False), ('staff', True)):
+    user = User(username='gdt_nav_%s' % audience, is_staff=is_staff,
+                is_active=True)
+    user._perm_cache = set()
+    users.append((audience, user))
+  return users
@@ -0,0 +1,210 @@
+"""
+Indexes for finding the menu options that match the current url.
+
+Rather than comparing the current url against every absolute url option in a
+menu group one at a time, the absolute url options of each group are indexed
+by their path in a trie.  The options matching a url are then found with a
+single walk down the trie (i.e. in time proportional to the length of the
+path, no matter how many options there are).
+
+By default an absolute url option only matches its exact url.  If the
+GDT_NAV_PREFIX_MATCH setting is True then options also match any url below
+theirs (e.g. an option for /news/ will match /news/2011/ as well) so that
+sections of a site can be highlighted, with the longest match being preferred.
+
+Named url options can only be generated when the current url provides the
+keyword arguments their url name needs.  The sets of arguments each url name
+can be reversed with are worked out once from the url resolver, so options
+that can't be generated are skipped with a set comparison instead of
+attempting (and failing) to reverse them.
+"""
+from urlparse import urlsplit
+
+from django.conf import settings
+from django.core.urlresolvers import get_resolver, get_urlconf
+from gdt_nav.cache import get_menu_version
+
+
+# Per-process store of the absolute url indexes of each group, mapping the
+# group's id to a tuple of (version, index).
+_absolute_url_indexes = {}
+
+# Per-process store of the keyword arguments needed to reverse url names,
+# keyed by (urlconf, url name).
+_url_requirements = {}
+
+
+class AbsoluteUrlIndex(object):
+  """A trie of absolute url menu options keyed by the segments of their paths.
+
+  """
+
+  def __init__(self):
+    """Create an empty index.
+
+    """
+
+    # Each node of the trie is a dictionary mapping path segments to child
+    # nodes, with the key None holding a list of (scheme, host, path,
+    # option id) tuples for the options whose path ends at that node.
+    self.root = {}
+
+  def add(self, url, option_id):
+    """Add an absolute url option to the index.
+
+    Keyword arguments:
+    url -- The url of the option.
+    option_id -- The id of the option.
+
+    """
+
+    scheme, host, path, query, fragment = urlsplit(url or '')
+    if query or fragment:
+      # The url of a request never has a query or fragment so these will
+      # never match.
+      return
+    node = self.root
+    for segment in _path_segments(path):
+      node = node.setdefault(segment, {})
+    node.setdefault(None, []).append((scheme, host.lower(), path, option_id))
+
+  def match(self, url, prefix=False):
+    """Find the options that match a url.
+
+    Keyword arguments:
+    url -- The absolute url to match.
+    prefix -- Whether options should also match urls below their own
+              (default False).
+
+    Returns:
+    A dictionary mapping the ids of the matching options to the number of
+    path segments they matched (higher is a better match).
+
+    """
+
+    scheme, host, path, query, fragment = urlsplit(url)
+    host = host.lower()
+    segments = _path_segments(path)
+    matches = {}
+    node = self.root
+    depth = 0
+    while node is not None:
+      for option_scheme, option_host, option_path, option_id in node.get(None, ()):
+        if option_scheme != scheme or option_host != host:
+          continue
+        if depth == len(segments):
+          # The whole path has been walked, but the option still needs to
+          # agree on whether there's a trailing slash.
+          if option_path == path or prefix:
+            matches[option_id] = depth
+        elif prefix:
+          matches[option_id] = depth
+      if depth == len(segments):
+        break
+      node = node.get(segments[depth])
+      depth += 1
+    return matches
+
+
+def get_absolute_url_index(menu_group, tree=None):
+  """Return the absolute url index for a menu group, building it if need be.
+
+  Keyword arguments:
+  menu_group -- The menu group to fetch the index for.
+  tree -- The group's gdt_nav.tree.MenuTree, if it has been loaded, to build
+          the index from rather than querying the database (default None).
+
+  """
+
+  from gdt_nav.models import MenuOption
+
+  version = get_menu_version(menu_group.pk)
+  cached = _absolute_url_indexes.get(menu_group.pk)
+  if cached is not None and cached[0] == version:
+    return cached[1]
+  index = AbsoluteUrlIndex()
+  if tree is not None:
+    options = [(node.id, node.url) for node in tree.nodes
+               if node.option_type == MenuOption.ABSOLUTE_URL_MENU_OPTION]
+  else:
+    options = menu_group.menu_items\
+                .filter(option_type=MenuOption.ABSOLUTE_URL_MENU_OPTION)\
+                .values_list('pk', 'url')
+  for option_id, url in options:
+    index.add(url, option_id)
+  _absolute_url_indexes[menu_group.pk] = (version, index)
+  return index
+
+def get_url_requirements(url_name):
+  """Return the sets of keyword arguments that a url name can be reversed with.
+
+  Keyword arguments:
+  url_name -- The name of the url.
+
+  Returns:
+  A tuple of frozensets of argument names, one for each way of reversing the
+  url.  The tuple is empty if the url name can never be reversed with keyword
+  arguments (e.g. it doesn't exist).
+
+  """
+
+  urlconf = get_urlconf()
+  key = (urlconf, url_name)
+  requirements = _url_requirements.get(key)
+  if requirements is None:
+    requirements = []
+    reverse_dict = get_resolver(urlconf).reverse_dict
+    if url_name in reverse_dict:
+      for possibilities, pattern in reverse_dict.getlist(url_name):
+        for result, params in possibilities:
+          requirements.append(frozenset(params))
+    requirements = tuple(requirements)
+    _url_requirements[key] = requirements
+  return requirements
+
+def find_url_arguments(url_name, kwargs):
+  """Return the names of the arguments to reverse a url name with, if any.
+
+  Keyword arguments:
+  url_name -- The name of the url.
+  kwargs -- The keyword arguments that are available.
+
+  Returns:
+  The first set of argument names from get_url_requirements that are all in
+  kwargs, or None if there isn't one.
+
+  """
+
+  for requirement in get_url_requirements(url_name):
+    if requirement.issubset(kwargs):
+      return requirement
+  return None
+
+def path_depth(url):
+  """Return the number of path segments in a url.
+
+  Keyword arguments:
+  url -- The url to check.
+
+  """
+
+  return len(_path_segments(urlsplit(url)[2]))
+
+def prefix_matching_enabled():
+  """Return whether absolute url options should match urls below their own.
+
+  """
+
+  return getattr(settings, 'GDT_NAV_PREFIX_MATCH', False)
+
+def _path_segments(path):
+  """Helper function to split a path into its segments.
+
+  Empty segments (from leading, trailing or doubled slashes) are dropped.
+
+  Keyword arguments:
+  path -- The path to split.
+
+  """
+
+  return [segment for segment in path.split('/') if segment]
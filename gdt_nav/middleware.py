@@ -0,0 +1,26 @@
+from gdt_nav.instrumentation import REQUEST_TIMINGS
+
+
+class MenuTimingMiddleware(object):
+  """Report the time spent rendering menus in an X-Menu-Timing header.
+
+  Requires GDT_NAV_INSTRUMENTATION to be enabled.  The header contains an
+  entry for each menu rendered during the request giving the total time
+  taken, the time for each stage, the number of queries and cache hits.
+
+  """
+
+  def process_response(self, request, response):
+    timings = getattr(request, REQUEST_TIMINGS, None)
+    if timings:
+      entries = []
+      for name, timer in timings:
+        parts = [name.encode('utf-8').replace(';', '').replace(',', ''),
+                 'total=%.2f' % (timer.total() * 1000)]
+        for stage, seconds in sorted(timer.timings.items()):
+          parts.append('%s=%.2f' % (stage, seconds * 1000))
+        parts.append('queries=%d' % timer.queries)
+        parts.append('cache_hits=%d' % timer.cache_hits)
+        entries.append(';'.join(parts))
+      response['X-Menu-Timing'] = ', '.join(entries)
+    return response
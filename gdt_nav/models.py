@@ -1,11 +1,30 @@
+import hmac
+import re
+
 from django.conf import settings
-from django.contrib.auth.models import Permission
+from django.contrib.auth.models import Group, Permission, User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.exceptions import FieldError
+from django.core.signals import request_finished, request_started
 from django.core.urlresolvers import reverse, get_resolver, NoReverseMatch
-from django.db import models
-from django.utils.translation import ugettext as _
+from django.db import models, transaction, DatabaseError
+from django.utils.encoding import smart_str
+from django.utils.http import urlencode
+from django.utils.hashcompat import md5_constructor, sha_constructor
+from django.utils.translation import get_language, ugettext as _
+from gdt_nav.cache import bump_menu_version, bump_model_version, \
+                          bump_permission_version, defer_menu_version_bumps, \
+                          flush_menu_version_bumps, get_model_version
+from gdt_nav.concurrency import concurrent_queries_enabled, get_pool, \
+                                submit, wait_all
+from gdt_nav.instrumentation import record_cache_hit
+from gdt_nav.matching import find_url_arguments, get_absolute_url_index, \
+                             path_depth, prefix_matching_enabled
+from gdt_nav.permissions import get_user_permission_mask, \
+                                get_user_permissions
+from gdt_nav.routers import get_read_database
 
 
 class MenuGroup(models.Model):
@@ -59,7 +78,27 @@ class MenuGroup(models.Model):
                     }
     return MenuGroup.link_template % string_params
 
-  def generate_hierarchy(self, request):
+  def agenerate_hierarchy(self, request, url_parts=None):
+    """Start generating the menu hierarchy for this MenuGroup in the background.
+
+    The hierarchy is generated in another thread (see gdt_nav.concurrency)
+    with the independent queries made concurrently, so that the caller isn't
+    blocked while the menu is generated.
+
+    Keyword arguments:
+    request -- The request object for the view that wants to generate some
+               menus.
+    url_parts -- The result of _fetch_current_url_parts for the request if it
+                 has already been calculated (default None).
+
+    Returns:
+    A MenuFuture whose result is the return value of generate_hierarchy.
+
+    """
+
+    return submit(self.generate_hierarchy, request, url_parts, True)
+
+  def generate_hierarchy(self, request, url_parts=None, concurrent=None):
     """Generate the menu hierarchy for this MenuGroup.
 
     Generate a set of lists that represent the hierarchy of menu options that
@@ -68,14 +107,22 @@ class MenuGroup(models.Model):
     Keyword arguments:
     request -- The request object for the view that wants to generate some
                menus.
+    url_parts -- The result of _fetch_current_url_parts for the request if it
+                 has already been calculated (default None).
+    concurrent -- Whether to make the queries for the options, the user's
+                  permissions and model option results concurrently on the pool of worker
+                  threads rather than one after another, or None to use the
+                  GDT_NAV_CONCURRENT_QUERIES setting (default None).
 
     Returns:
     A tuple of (displayable_options, selected_options, selected_params)
     displayable_options -- A dictionary mapping a parent menu item (either a
-                           MenuOption object or the string 'ROOT' for the top
-                           level of the menu) to a list of MenuOption objects
+                           MenuNode object or the string 'ROOT' for the top
+                           level of the menu) to a list of MenuNode objects
                            which sit on a sub menu below the key option.
-    selected_options -- A dictionary mapping MenuOptions to a boolean.  Each
+                           MenuNodes (see gdt_nav.tree) stand in for the
+                           MenuOptions of the group.
+    selected_options -- A dictionary mapping MenuNodes to a boolean.  Each
                         key is a menu option that either represents the current
                         url or is an ancestor of that option.  The boolean
                         values represent whether the option actually is
@@ -89,48 +136,72 @@ class MenuGroup(models.Model):
     # The user is required for checking access permissions.
     user = request.user
 
-    # Start by obtaining a sorted list of the options to be used.
-    menu_options = self.menu_items.order_by('ordering')
-    if Site._meta.installed:
-      # If the Sites app has been installed then filter by site id.
-      menu_options = menu_options.filter(sites__id__exact=settings.SITE_ID)
-
-    if user.is_anonymous():
-      # Filter out anything that can't be seen by an anonymous user.
-      menu_options = menu_options.filter(show_to_anonymous=True)
-    else:
-      # Build up a filter, we know we definitely want everything that logged
-      # in users can see.
-      query_filter = models.Q(show_to_authenticated=True)
-      if user.is_staff:
-        # Staff get to see anything authenticated users can see as well as what
-        # only they are allowed to see.
-        query_filter |= models.Q(show_to_staff=True)
-      menu_options = menu_options.filter(query_filter)
+    if url_parts is None:
+      url_parts = self._fetch_current_url_parts(request)
+    url, url_name, url_kwargs = url_parts
+
+    # The hierarchy may already have been generated for this request (e.g. by
+    # a menu tag before the breadcrumbs are rendered).
+    hierarchies = request.__dict__.setdefault(REQUEST_HIERARCHIES, {})
+    if (self.pk, url) in hierarchies:
+      return hierarchies[(self.pk, url)]
+
+    # Start by loading the tree of options, which holds a sorted list of the
+    # options to be used (filtered by site id if the Sites app has been
+    # installed), unless it was preloaded along with the other groups on the
+    # page.
+    from gdt_nav.preload import get_preloaded_tree
+    tree = get_preloaded_tree(request, self)
+    if concurrent is None:
+      concurrent = concurrent_queries_enabled()
+    if concurrent:
+      tree = self._load_tree_concurrently(user, url_kwargs, tree)
+    elif tree is None:
+      tree = self.load_tree()
+    # The permissions the user has out of those the options need, as a mask.
+    user_mask = get_user_permission_mask(user, tree)
 
     # Initialise variables to store options.
     matched_options = [] # options that are visible and match the current url
     visible_options = [] # options that are visible
-
-    # Loop through the remaining options to see if firstly the user has
-    # permission to see the option and secondly if the option should be
-    # selected.
-    url, url_name, url_kwargs = self._fetch_current_url_parts(request)
-    for menu_option in menu_options:
-      # If the user is anonymous then they will be able to see all remaining
-      # menu options.  If they are not anonymous then we need to ensure they
-      # have the valid permissions to see the option.
+    visible_ids = set() # ids of the options that are visible
+
+    # Loop through the options to see if firstly the user has permission to
+    # see the option and secondly if the option should be selected.
+    # Find the absolute url options that match the current url in one go
+    # rather than checking each of them in turn.
+    prefix_match = prefix_matching_enabled()
+    absolute_matches = get_absolute_url_index(self, tree).match(url,
+                                                                prefix_match)
+    # Likewise only the options with the current url name can match it.
+    named_candidates = tree.url_name_index.get(url_name, ())
+    for menu_option in tree.nodes:
+      # Skip anything that can't be seen by this type of user.  If the user is
+      # anonymous then they will be able to see all remaining menu options.
+      # If they are not anonymous then we need to ensure they have the valid
+      # permissions to see the option.
       # Also check to ensure the MenuOption can be generated correctly (make
       # sure that it has all the required named_url arguments etc.)
-      if (user.is_anonymous()\
-        or user.has_perms(menu_option.permissions.all()))\
+      if _audience_can_see(user, menu_option)\
+        and not menu_option.permission_mask & ~user_mask\
         and menu_option.can_generate(url_kwargs):
         # Mark the option as visible to the user
         visible_options.append(menu_option)
+        visible_ids.add(menu_option.id)
         # Check to see if the menu option is a match for the current url
-        if menu_option.url_matches(url, url_name, url_kwargs):
+        if menu_option.option_type == MenuOption.ABSOLUTE_URL_MENU_OPTION:
+          if menu_option.pk in absolute_matches:
+            matched_options.append((menu_option, url_kwargs))
+        elif menu_option.pk in named_candidates\
+          and menu_option.url_matches(url, url_name, url_kwargs):
           # Mark the option as a match
           matched_options.append((menu_option, url_kwargs))
+    if prefix_match:
+      # Options that matched more of the url take precedence, anything that
+      # isn't an absolute url option matched the whole url.
+      full_depth = path_depth(url)
+      matched_options.sort(key=lambda match: -absolute_matches.get(match[0].pk,
+                                                                   full_depth))
 
     # Loop through matched options to locate which option should be selected
     # the first option whose ancestors are all visible will be used.
@@ -140,13 +211,13 @@ class MenuGroup(models.Model):
       selected_options = {option:True,} # options in the selected hierarchy.
       selected_params  = params # url keyword arguments for this option.
       # Check if the option is on the root level.
-      if opt.parent is None:
+      if opt.parent_id is None:
         # Break out of the for loop as we've found our option.
         break
       # Loop until we get to a root level item.
-      while opt.parent is not None:
+      while opt.parent_id is not None:
         # Check if the parent option can be seen for this request.
-        if opt.parent not in visible_options:
+        if opt.parent_id not in visible_ids:
           # Break out of the while loop to try the next option.
           break
         else:
@@ -175,16 +246,113 @@ class MenuGroup(models.Model):
     # one of the lucky ones to be expanded (or None).
     for option in visible_options:
       # Check if the option has a parent.
-      if option.parent is None:
+      if option.parent_id is None:
         # No parent means the option should exist on the ROOT level.
         displayable_options['ROOT'].append(option)
-      elif option.parent in selected_options.keys():
+      elif option.parent in selected_options:
         # If the parent is a selcted option the add the option to its
         # sub-menu.
         displayable_options[option.parent].append(option)
+    hierarchies[(self.pk, url)] = (displayable_options, selected_options,
+                                   selected_params)
     return displayable_options, selected_options, selected_params
 
-  def _fetch_current_url_parts(self, request):
+  def generate_trail(self, request, url_parts=None):
+    """Generate a breadcrumb trail from the options selected in this MenuGroup.
+
+    The trail runs from the top level option down to the option representing
+    the current url, following the options selected by generate_hierarchy.
+
+    Keyword arguments:
+    request -- The request object for the view that wants to generate the
+               trail.
+    url_parts -- The result of _fetch_current_url_parts for the request if it
+                 has already been calculated (default None).
+
+    Returns:
+    A list of (url, title) tuples, empty if no option represents the current
+    url.
+
+    """
+
+    hierarchies, selected_options, selected_params = \
+      self.generate_hierarchy(request, url_parts)
+    trail = []
+    for matched, is_match in selected_options.items():
+      if is_match:
+        # Walk up from the matching option, picking out the selected result of
+        # any model options on the way.
+        option = matched
+        while option is not None:
+          for string_params, selected in option.as_data(selected_params,
+                                                        option is matched):
+            if selected or option.option_type != MenuOption.MODEL_MENU_OPTION:
+              trail.append((string_params['url'], string_params['link_text']))
+              break
+          option = option.parent
+        trail.reverse()
+        break
+    return trail
+
+  def load_tree(self, current_site_only=True):
+    """Load all of the options of this MenuGroup as a tree.
+
+    The options are returned as lightweight gdt_nav.tree.MenuNode objects
+    with their parents, children and permissions already resolved so that
+    nothing needs to be fetched lazily whilst rendering.
+
+    Keyword arguments:
+    current_site_only -- Whether to leave out options that aren't on the
+                         current site, when the sites app is installed
+                         (default True).
+
+    Returns:
+    A gdt_nav.tree.MenuTree.
+
+    """
+
+    from gdt_nav.tree import load_menu_tree
+    return load_menu_tree(self, current_site_only)
+
+  def _load_tree_concurrently(self, user, url_kwargs, tree=None):
+    """Helper function to make the queries generate_hierarchy needs at once.
+
+    The tree of options and the user's own permissions are fetched
+    concurrently, followed by the results of all of the model options the
+    user can see, all on the pool of worker threads so the total time taken
+    is roughly that of the slowest query.
+
+    Keyword arguments:
+    user -- The user the hierarchy is being generated for.
+    url_kwargs -- The url keyword arguments for the current request.
+    tree -- The tree of options if it has already been loaded (default None).
+
+    Returns:
+    A gdt_nav.tree.MenuTree with the results of its model options prefetched.
+
+    """
+
+    pool = get_pool()
+    futures = []
+    if tree is None:
+      futures.append(pool.submit(self.load_tree))
+    if not user.is_anonymous():
+      # Fills the user's permission cache ready for checking the options.
+      futures.append(pool.submit(get_user_permissions, user))
+    results = wait_all(futures)
+    if tree is None:
+      tree = results[0]
+    user_mask = get_user_permission_mask(user, tree)
+    model_options = [menu_option for menu_option in tree.nodes
+                     if menu_option.option_type == MenuOption.MODEL_MENU_OPTION
+                     and _audience_can_see(user, menu_option)
+                     and not menu_option.permission_mask & ~user_mask]
+    wait_all([pool.submit(menu_option.prefetch_results, url_kwargs)
+              for menu_option in model_options])
+    return tree
+
+  @staticmethod
+  def _fetch_current_url_parts(request):
     """Helper function that reports information on the request's url.
 
     This utility function takes a request and analyses its url to generate the
@@ -207,6 +375,12 @@ class MenuGroup(models.Model):
 
     """
 
+    # The url parts are the same for every menu on the page so only work them
+    # out once per request.
+    cached = getattr(request, '_gdt_nav_url_parts', None)
+    if cached is not None and cached[0] == request.path_info:
+      return cached[1]
+
     # Start by fetching the path from the request and using it to build
     # the full url.
     path = request.path_info
@@ -243,9 +417,137 @@ class MenuGroup(models.Model):
           # The parameters were wrong - ah well, maybe the next one will
           # succeed.
           pass
+    request._gdt_nav_url_parts = (path, (url, url_name, url_kwargs))
     return url, url_name, url_kwargs
 
 
+# The attribute of the request that generated hierarchies are kept in.
+REQUEST_HIERARCHIES = '_gdt_nav_hierarchies'
+
+def _keyset_filter(ordering, values):
+  """Helper function to filter for the results after a result in an ordering.
+
+  Keyword arguments:
+  ordering -- The fields the results are ordered by, as passed to order_by.
+  values -- The values of the fields for the result.
+
+  Returns:
+  A Q object matching the results that come after the one given.
+
+  """
+
+  condition = None
+  equal = {}
+  for field, value in zip(ordering, values):
+    name = str(field.lstrip('-'))
+    if field.startswith('-'):
+      lookup = '%s__lt' % name
+    else:
+      lookup = '%s__gt' % name
+    after = dict(equal)
+    after[lookup] = value
+    if condition is None:
+      condition = models.Q(**after)
+    else:
+      condition |= models.Q(**after)
+    equal[name] = value
+  return condition
+
+def nullable_ordering_fields(model, ordering):
+  """Return the fields of an ordering that can be null.
+
+  The results of paginated model options are continued from the values of
+  their ordering fields, which doesn't work for nulls since they can't be
+  compared (and aren't sorted the same way by every database).
+
+  Keyword arguments:
+  model -- The model class being ordered.
+  ordering -- The fields the results are ordered by, as passed to order_by.
+
+  Returns:
+  A list of the fields (as given in the ordering) that can be null, either
+  themselves or through a nullable relation they follow.
+
+  """
+
+  nullable = []
+  for field in ordering:
+    opts = model._meta
+    for name in field.lstrip('-').split('__'):
+      if name == 'pk':
+        break
+      try:
+        related, related_model, direct, m2m = opts.get_field_by_name(name)
+      except models.FieldDoesNotExist, e:
+        # Unknown fields are reported when the results are fetched.
+        break
+      if not direct or m2m or related.null:
+        # Reverse and many to many relations can be missing as well.
+        nullable.append(field)
+        break
+      if related.rel is None:
+        break
+      opts = related.rel.to._meta
+  return nullable
+
+def _format_link(template, string_params):
+  """Helper function to fill in a link template for a model option's result.
+
+  The link is formatted again to add its classes so any percent signs (e.g.
+  in escaped urls) in the values are doubled.
+
+  Keyword arguments:
+  template -- MenuOption.link_template or MenuOption.non_link_template.
+  string_params -- The url, title and link_text of the result.
+
+  """
+
+  escaped = {}
+  for name, value in string_params.items():
+    if isinstance(value, basestring):
+      value = value.replace('%', '%%')
+    escaped[name] = value
+  return template % escaped
+
+def more_link_signature(option_id, params, after):
+  """Return the signature of the arguments of a 'more...' link.
+
+  The url keyword arguments of a 'more...' link are used in the option's
+  query, so they're signed (with the SECRET_KEY setting) to stop anyone
+  making up their own.
+
+  Keyword arguments:
+  option_id -- The id of the model menu option.
+  params -- The url keyword arguments, urlencoded.
+  after -- The model_id value of the last result shown.
+
+  """
+
+  message = smart_str(u'%s:%s:%s' % (option_id, params, after))
+  return hmac.new('gdt_nav.more:' + settings.SECRET_KEY, message,
+                  sha_constructor).hexdigest()
+
+# Matches the url keyword arguments used in the query of model menu options.
+_query_argument_pattern = re.compile(r'%\((\w+)\)')
+
+
+def _audience_can_see(user, menu_option):
+  """Helper function to check if an option is shown to a type of user.
+
+  Keyword arguments:
+  user -- The user to check.
+  menu_option -- The menu option to check.
+
+  """
+
+  if user.is_anonymous():
+    return menu_option.show_to_anonymous
+  # Staff get to see anything authenticated users can see as well as what
+  # only they are allowed to see.
+  return menu_option.show_to_authenticated \
+    or (user.is_staff and menu_option.show_to_staff)
+
+
 class AbsoluteMenuOptionManager(models.Manager):
   """Manager that only creates/returns absolute url menu options.
 
@@ -358,6 +660,14 @@ class MenuOption(models.Model):
                               help_text="Any sorting to be done on the query - format is as if entering directly into a django order_by filter, comma separate multiple order keys - will happen after filtering (required for model menu options).")
   result_limit = models.PositiveSmallIntegerField(blank=True, null=True,
                                                   help_text="Number of results to return (required for model menu options).")
+  label_field = models.CharField(max_length=128, blank=True, default='',
+                                 help_text="The field to use as the text of each result - format is as if entering directly into a django values_list, use __ to follow relations - if empty the result itself will be used (optional for model menu options).")
+  select_related = models.CharField(max_length=256, blank=True, default='',
+                                    help_text="Any related objects to fetch along with the results - format is as if entering directly into a django select_related, comma separate multiple relations (optional for model menu options).")
+  cache_timeout = models.PositiveIntegerField(blank=True, null=True,
+                                              help_text="Number of seconds to cache the results for, the cached results are shared by all users so the query must not depend on who is viewing the menu (optional for model menu options).")
+  paginate = models.BooleanField(default=False,
+                                 help_text="Whether to follow the results with a 'more...' link to the next page of results when there are more than the result limit, the order_by fields should be indexed and can't allow nulls (optional for model menu options).")
 
   def __unicode__(self):
     return self.name
@@ -462,6 +772,43 @@ class MenuOption(models.Model):
                       }
       return ((MenuOption.non_link_template % string_params, True),)
 
+  def as_data(self, url_params=None, can_select=False):
+    """Generate a plain data representation of this menu option.
+
+    This mirrors as_link and as_non_link but returns the pieces of each link
+    rather than an HTML string, for use when the menu is being rendered
+    somewhere other than a django template (e.g. as JSON for client side
+    rendering).
+
+    Keyword arguments:
+    url_params -- The url keyword arguments that can be used in the reverse
+                  function or url template tag to generate a url
+                  (default=None).
+    can_select -- Whether the option is the one representing the current url
+                  (default=False).
+
+    Returns:
+    A list of tuples, each consisting of a dictionary with the url, title and
+    link_text of the item followed by a boolean specifying if the item is
+    selected.
+
+    """
+
+    # If no params were passed in, turn the variable into an empty dictionary.
+    url_params = url_params or {}
+    if self.option_type == MenuOption.MODEL_MENU_OPTION:
+      # Model options are only selected if one of their results matches.
+      return self._generate_model_type_params(url_params)
+    elif self.option_type == MenuOption.ABSOLUTE_URL_MENU_OPTION:
+      url = self.url
+    elif self.option_type == MenuOption.NAMED_URL_MENU_OPTION:
+      url = self._generate_named_link(url_params)
+    string_params = { 'url': url,
+                      'title': _(self.alt_text),
+                      'link_text': _(self.name),
+                    }
+    return [(string_params, can_select)]
+
   def can_generate(self, kwargs):
     """Check to see if the option can be generated with the arguments provided.
 
@@ -473,6 +820,9 @@ class MenuOption(models.Model):
 
     # Check if we're dealing with a model.
     if self.option_type == MenuOption.MODEL_MENU_OPTION:
+      if self.cache_timeout or hasattr(self, '_prefetched_results'):
+        # The results are going to be needed anyway and are cached.
+        return len(self._fetch_results(kwargs)) > 0
       # Will we get any results from the queryset?
       queryset = self._fetch_queryset(**kwargs)
       return queryset.count() > 0
@@ -544,6 +894,12 @@ class MenuOption(models.Model):
     queryset = MenuOption.objects.none()
     try:
       if self.query:
+        # Values that would split into extra lookups when the query is
+        # parsed below can't be allowed in.
+        for name in _query_argument_pattern.findall(self.query):
+          if name in kwargs and (',' in unicode(kwargs[name])
+                                 or '=' in unicode(kwargs[name])):
+            raise KeyError(name)
         # Expand the query with arguments from urls.
         full_query = str(self.query % kwargs)
         # Convert the string form of the query into a kwargs style dictionary
@@ -551,7 +907,11 @@ class MenuOption(models.Model):
       else:
         query_kwargs = {}
       # Get the object manager
-      manager = getattr(self.content_type.model_class(), self.manager, None)
+      model_class = self.content_type.model_class()
+      manager = getattr(model_class, self.manager, None)
+      database = get_read_database(model_class)
+      if database is not None:
+        manager = manager.db_manager(database)
       # Generate the queryset
       queryset = manager.filter(**query_kwargs)
     except (KeyError, FieldError), e:
@@ -567,13 +927,25 @@ class MenuOption(models.Model):
     for extra_filter in args:
       queryset = queryset.filter(**extra_filter)
     # Apply any ordering instructions.
-    if self.order_by:
-      queryset = queryset.order_by(*self.order_by.split(','))
-    # Limit the results.
-    if self.result_limit:
-      queryset = queryset[:self.result_limit]
+    ordering = self._ordering()
+    if ordering:
+      queryset = queryset.order_by(*ordering)
     return queryset
 
+  def _ordering(self):
+    """Helper function to list the fields the results are ordered by.
+
+    Paginated results are also ordered by their primary key so that every
+    result has a distinct position to continue from.
+
+    """
+
+    ordering = [field.strip() for field in (self.order_by or '').split(',')
+                if field.strip()]
+    if self.paginate and 'pk' not in ordering and '-pk' not in ordering:
+      ordering.append('pk')
+    return ordering
+
   def _generate_model_type_string(self, url_params, can_select):
     """Helper function to generate a set of links for a model type option.
 
@@ -593,62 +965,290 @@ class MenuOption(models.Model):
 
     """
 
-    # Items to be plugged into the templates.
-    string_params = { 'url': '',
-                      'title': _(self.alt_text),
-                      'link_text': _(self.name),
-                    }
     results = []
-    # Loop through all the items matched by this url.
-    for obj in self._fetch_queryset(**url_params):
-      string_params['url'] = self._generate_model_type_link(obj, url_params)
+    for string_params, is_selected in self._generate_model_type_params(url_params):
+      # If the url match has been pinpointed to this group and the current
+      # object matches the arguments then display as a span.
+      # Otherwise show the link.
+      if can_select and is_selected:
+        results.append((_format_link(MenuOption.non_link_template,
+                                     string_params), True))
+      else:
+        results.append((_format_link(MenuOption.link_template, string_params),
+                        is_selected))
+    return results
+
+  def _generate_model_type_params(self, url_params):
+    """Helper function to generate the link details for a model type option.
+
+    Keyword arguments:
+    url_params -- The url keyword arguments for the current request.
+
+    Returns:
+    A list of tuples, each consisting of a dictionary with the url, title and
+    link_text of a result item followed by a boolean specifying if the item
+    matches the current url arguments.
 
-      # Rely on the fact that __unicode__ has been defined for the model being
-      # used and that it will return an accurate description.
-      string_params['link_text'] = unicode(obj)
+    """
+
+    results = []
+    fetched = self._fetch_results(url_params)
+    more_url = None
+    if self.paginate and self.result_limit \
+      and len(fetched) > self.result_limit:
+      # There's at least one more result than will be shown.
+      fetched = fetched[:self.result_limit]
+      if not nullable_ordering_fields(self.content_type.model_class(),
+                                      self._ordering()):
+        more_url = self._generate_more_link(fetched[-1][0], url_params)
+    # Loop through all the items matched by this url.
+    for model_value, link_text in fetched:
+      url = self._generate_model_type_link(model_value, url_params)
+      if url is None:
+        # The item can't be linked to from the current page.
+        continue
+      string_params = { 'url': url,
+                        'title': _(self.alt_text),
+                        'link_text': link_text,
+                      }
 
       # Calculate whether the item in question matches the url arguments
       # This indicates that either this item or one of it's sub menus has
       # been selected.
-      _model_value = str(getattr(obj, self.model_id, None))
+      _model_value = str(model_value)
       _url_args_value = str(url_params.get(self.url_id,False))
       is_selected = _model_value == _url_args_value
+      results.append((string_params, is_selected))
+    if more_url is not None:
+      results.append(({ 'url': more_url,
+                        'title': _(self.alt_text),
+                        'link_text': _('more...'),
+                      }, False))
+    return results
 
-      # If the url match has been pinpointed to this group and the current
-      # object matches the arguments then display as a span.
-      # Otherwise show the link.
-      if can_select and is_selected:
-        results.append((MenuOption.non_link_template % string_params, True))
+  def fetch_page(self, url_params, after):
+    """Fetch the page of results of a paginated model option after a result.
+
+    Pages are found by the values of the ordering fields of the result they
+    follow (a keyset) rather than by an offset, so every page is as quick to
+    fetch as the first.
+
+    Keyword arguments:
+    url_params -- The url keyword arguments for the current request.
+    after -- The model_id value of the result the page follows.
+
+    Returns:
+    A tuple of (results, more), results being a list of tuples of (model_id
+    value, link text) and more being whether there are any results after the
+    page.
+
+    """
+
+    queryset = self._fetch_queryset(**url_params)
+    ordering = self._ordering()
+    keys = queryset.filter(**{str(self.model_id): after})\
+                   .values_list(*[field.lstrip('-') for field in ordering])
+    if not keys or None in keys[0]:
+      # A null can't be continued from (see nullable_ordering_fields).
+      return [], False
+    queryset = queryset.filter(_keyset_filter(ordering, keys[0]))
+    if self.result_limit:
+      queryset = queryset[:self.result_limit + 1]
+    results = self._result_values(queryset)
+    if self.result_limit and len(results) > self.result_limit:
+      return results[:self.result_limit], True
+    return results, False
+
+  def prefetch_results(self, url_params):
+    """Fetch the results of a model option ready for generating it.
+
+    The results are kept on the option so that checking and generating the
+    option doesn't query the database again.
+
+    Keyword arguments:
+    url_params -- The url keyword arguments for the current request.
+
+    """
+
+    results = self._fetch_results(url_params)
+    if not hasattr(self, '_prefetched_results'):
+      self._prefetched_results = {}
+    self._prefetched_results[self._query_arguments(url_params)] = results
+
+  def _fetch_results(self, url_params):
+    """Helper function to fetch the values needed to display a model option.
+
+    If the results have been prefetched then they are used, otherwise if a
+    cache_timeout has been given then the results are cached, shared by every
+    user, keyed by the url keyword arguments used in the query.
+
+    Keyword arguments:
+    url_params -- The url keyword arguments for the current request.
+
+    Returns:
+    A list of tuples of (model_id value, link text) for each result.
+
+    """
+
+    prefetched = getattr(self, '_prefetched_results', {})
+    query_arguments = self._query_arguments(url_params)
+    if query_arguments in prefetched:
+      return prefetched[query_arguments]
+    if not self.cache_timeout:
+      return self._query_results(url_params)
+    key = self._results_cache_key(url_params)
+    results = cache.get(key)
+    if results is None:
+      results = self._query_results(url_params)
+      cache.set(key, results, self.cache_timeout)
+    else:
+      record_cache_hit()
+    return results
+
+  def _results_cache_key(self, url_params):
+    """Helper function to generate the cache key for a model option's results.
+
+    The key changes whenever anything affecting the results changes: the
+    option's settings, the url keyword arguments used in its query, the
+    language (in case the results are translated) and, when
+    GDT_NAV_MODEL_CACHE_INVALIDATION is on, the model's data.
+
+    Keyword arguments:
+    url_params -- The url keyword arguments for the current request.
+
+    """
+
+    key_parts = [self.content_type_id, self.manager, self.query,
+                 self.model_id, self.order_by, self.result_limit,
+                 self.label_field, self.select_related, self.paginate,
+                 get_language()]
+    key_parts.extend(self._query_arguments(url_params))
+    if getattr(settings, 'GDT_NAV_MODEL_CACHE_INVALIDATION', False):
+      model = self.content_type.model_class()
+      watch_model_data(model)
+      key_parts.append(get_model_version(model))
+    key_hash = md5_constructor(smart_str(repr(key_parts))).hexdigest()
+    return 'gdt_nav:results:%s:%s' % (self.pk, key_hash)
+
+  def _query_arguments(self, url_params):
+    """Helper function to pick out the url keyword arguments used in the query.
+
+    Keyword arguments:
+    url_params -- The url keyword arguments for the current request.
+
+    Returns:
+    A tuple of (name, value) pairs sorted by name.
+
+    """
+
+    names = sorted(set(_query_argument_pattern.findall(self.query or '')))
+    return tuple([(name, url_params.get(name)) for name in names])
+
+  def _query_results(self, url_params):
+    """Helper function to query the values needed to display a model option.
+
+    If a label_field has been given then only the model_id and label_field
+    values are fetched from the database, otherwise the full objects are
+    fetched (along with any select_related relations).
+
+    Keyword arguments:
+    url_params -- The url keyword arguments for the current request.
+
+    Returns:
+    A list of tuples of (model_id value, link text) for each result (with one
+    result more than the limit for paginated options, to show that there are
+    more).
+
+    """
+
+    queryset = self._fetch_queryset(**url_params)
+    # Limit the results.
+    if self.result_limit:
+      if self.paginate:
+        queryset = queryset[:self.result_limit + 1]
+      else:
+        queryset = queryset[:self.result_limit]
+    return self._result_values(queryset)
+
+  def _result_values(self, queryset):
+    """Helper function to fetch the values to display for a queryset.
+
+    Keyword arguments:
+    queryset -- The queryset of results.
+
+    Returns:
+    A list of tuples of (model_id value, link text) for each result.
+
+    """
+
+    if self.label_field:
+      try:
+        return [(model_value, unicode(link_text)) for model_value, link_text
+                in queryset.values_list(self.model_id, self.label_field)]
+      except FieldError, e:
+        # One of them isn't a field (e.g. it's a property) so fall back to
+        # fetching the objects.
+        pass
+    if self.select_related:
+      queryset = queryset.select_related(*[relation.strip() for relation
+                                           in self.select_related.split(',')])
+    results = []
+    for obj in queryset:
+      if self.label_field:
+        link_text = obj
+        for attr in self.label_field.split('__'):
+          link_text = getattr(link_text, attr, None)
+          if callable(link_text):
+            link_text = link_text()
       else:
-        results.append((MenuOption.link_template % string_params, is_selected))
+        # Rely on the fact that __unicode__ has been defined for the model
+        # being used and that it will return an accurate description.
+        link_text = obj
+      results.append((getattr(obj, self.model_id, None), unicode(link_text)))
     return results
 
-  def _generate_model_type_link(self, obj, kwargs):
+  def _generate_more_link(self, model_value, kwargs):
+    """Helper function to generate the url of the next page of a model option.
+
+    Keyword arguments:
+    model_value -- The model_id value of the last result shown.
+    kwargs -- The url keyword arguments from the current request's url.
+
+    """
+
+    try:
+      url = reverse('gdt_nav_menu_more', kwargs={'option_id': self.pk})
+    except NoReverseMatch, e:
+      return None
+    params = urlencode(kwargs)
+    return '%s?%s' % (url, urlencode([('params', params),
+                                      ('after', model_value),
+                                      ('sig', more_link_signature(self.pk,
+                                                                  params,
+                                                                  model_value)),
+                                     ]))
+
+  def _generate_model_type_link(self, model_value, kwargs):
     """Helper function to generate a url for a result item of a model option.
 
     Keyword arguments:
-    obj -- The result model object.
+    model_value -- The value of the result's model_id attribute.
     kwargs -- The url keyword arguments from the current request's url.
 
     """
 
+    # The extra argument added by the model menu type is put in specially.
+    available = dict(kwargs)
+    available[self.url_id] = str(model_value)
+    # Find the arguments required for reversing this url.  If any are missing
+    # then return None - there won't be any link being generated here...
+    arg_names = find_url_arguments(self.url_name, available)
+    if arg_names is None:
+      return None
     try:
-      url_kwargs = {}
-      resolver = get_resolver(None)
-      # Loop through the arguments required for reversing this url and extract
-      # only the required ones from the request's keyword args.
-      for arg_name in resolver.reverse_dict[self.url_name][0][0][1]:
-        if arg_name == self.url_id:
-          # If the argument is the extra one added by the model menu type then
-          # put it in specially.
-          url_kwargs[arg_name] = str(getattr(obj, self.model_id))
-        elif arg_name not in kwargs:
-          # If there's a missing argument then return None - there won't be
-          # any link being generated here...
-          return None
-        else:
-          # Otherwise just add it to the dictionary.
-          url_kwargs[arg_name] = kwargs[arg_name]
+      # Extract only the required arguments.
+      url_kwargs = dict([(arg_name, available[arg_name])
+                         for arg_name in arg_names])
       # Generate the url.
       url = reverse(self.url_name, kwargs=url_kwargs)
       return url
@@ -663,20 +1263,16 @@ class MenuOption(models.Model):
 
     """
 
+    # Find the arguments required for reversing this url.  If any are missing
+    # from the request's keyword args then return None - there won't be any
+    # link being generated here...
+    arg_names = find_url_arguments(self.url_name, kwargs)
+    if arg_names is None:
+      return None
     try:
-      url_kwargs = {}
-      resolver = get_resolver(None)
-
-      # Loop through the arguments required for reversing this url and extract
-      # only the required ones from the request's keyword args.
-      for arg_name in resolver.reverse_dict[self.url_name][0][0][1]:
-        if arg_name not in kwargs:
-          # If there's a missing argument then return None - there won't be
-          # any link being generated here...
-          return None
-        else:
-          # Otherwise just add it to the dictionary.
-          url_kwargs[arg_name] = kwargs[arg_name]
+      # Extract only the required arguments from the request's keyword args.
+      url_kwargs = dict([(arg_name, kwargs[arg_name])
+                         for arg_name in arg_names])
       # Generate the url.
       url = reverse(self.url_name, kwargs=url_kwargs)
       return url
@@ -699,6 +1295,10 @@ def _menu_option_pre_save_hook(sender, **kwargs):
       menu_option.model_id = ''
       menu_option.order_by = ''
       menu_option.result_limit = None
+      menu_option.label_field = ''
+      menu_option.select_related = ''
+      menu_option.cache_timeout = None
+      menu_option.paginate = False
     elif menu_option.option_type == MenuOption.NAMED_URL_MENU_OPTION:
       menu_option.url = None
       menu_option.content_type = None
@@ -708,6 +1308,226 @@ def _menu_option_pre_save_hook(sender, **kwargs):
       menu_option.model_id = ''
       menu_option.order_by = ''
       menu_option.result_limit = None
+      menu_option.label_field = ''
+      menu_option.select_related = ''
+      menu_option.cache_timeout = None
+      menu_option.paginate = False
     elif menu_option.option_type == MenuOption.MODEL_MENU_OPTION:
       menu_option.url = None
 models.signals.pre_save.connect(_menu_option_pre_save_hook, sender=MenuOption)
+
+def _menu_option_track_group_hook(sender, **kwargs):
+  """Function to hook into the pre-save model signal and note the old group.
+
+  If an option is moved between groups then both groups will need their
+  version bumping once it has been saved.
+
+  """
+
+  menu_option = kwargs.get('instance')
+  if menu_option is not None and menu_option.pk is not None:
+    old_group_ids = MenuOption.objects.filter(pk=menu_option.pk)\
+                                      .values_list('menu_group', flat=True)
+    if old_group_ids:
+      menu_option._old_menu_group_id = old_group_ids[0]
+models.signals.pre_save.connect(_menu_option_track_group_hook, sender=MenuOption)
+
+def _menu_option_changed_hook(sender, **kwargs):
+  """Function to hook into the post-save/delete signals of menu options.
+
+  """
+
+  menu_option = kwargs.get('instance')
+  if menu_option is not None:
+    bump_menu_version(menu_option.menu_group_id)
+    old_group_id = getattr(menu_option, '_old_menu_group_id', None)
+    if old_group_id is not None and old_group_id != menu_option.menu_group_id:
+      bump_menu_version(old_group_id)
+models.signals.post_save.connect(_menu_option_changed_hook, sender=MenuOption)
+models.signals.post_delete.connect(_menu_option_changed_hook, sender=MenuOption)
+
+def _menu_group_changed_hook(sender, **kwargs):
+  """Function to hook into the post-save/delete signals of menu groups.
+
+  """
+
+  menu_group = kwargs.get('instance')
+  if menu_group is not None:
+    bump_menu_version(menu_group.pk)
+models.signals.post_save.connect(_menu_group_changed_hook, sender=MenuGroup)
+models.signals.post_delete.connect(_menu_group_changed_hook, sender=MenuGroup)
+
+def _menu_data_changed_hook(sender, **kwargs):
+  """Function to hook into signals for data that may affect any menu group.
+
+  """
+
+  bump_menu_version()
+models.signals.post_save.connect(_menu_data_changed_hook, sender=Permission)
+models.signals.post_delete.connect(_menu_data_changed_hook, sender=Permission)
+if Site._meta.installed:
+  models.signals.post_save.connect(_menu_data_changed_hook, sender=Site)
+  models.signals.post_delete.connect(_menu_data_changed_hook, sender=Site)
+
+def _menu_option_m2m_changed_hook(sender, **kwargs):
+  """Function to hook into the m2m-changed signal of menu option relations.
+
+  """
+
+  if not kwargs.get('action', '').startswith('post_'):
+    return
+  instance = kwargs.get('instance')
+  if isinstance(instance, MenuOption):
+    bump_menu_version(instance.menu_group_id)
+  else:
+    # The change was made from the other side of the relation so it may
+    # affect options in any group.
+    bump_menu_version()
+
+def _permissions_changed_hook(sender, **kwargs):
+  """Function to hook into signals for changes to users' permissions.
+
+  """
+
+  if kwargs.get('action', 'post_').startswith('post_'):
+    bump_permission_version()
+models.signals.post_save.connect(_permissions_changed_hook, sender=Permission)
+models.signals.post_delete.connect(_permissions_changed_hook, sender=Permission)
+models.signals.post_delete.connect(_permissions_changed_hook, sender=Group)
+
+def watch_model_data(model):
+  """Invalidate the cached results of model menu options when a model changes.
+
+  The post_save and post_delete signals of the model are listened to from
+  then on in this process.  The models of every model menu option that
+  caches its results are watched when the app is loaded (see
+  _watch_cached_models), and any others as options that cache their results
+  are used or saved.
+
+  Keyword arguments:
+  model -- The model class.
+
+  """
+
+  if model is None or model in _watched_models:
+    return
+  dispatch_uid = 'gdt_nav_model_data:%s.%s' % (model._meta.app_label,
+                                               model._meta.object_name)
+  models.signals.post_save.connect(_model_data_changed_hook, sender=model,
+                                   dispatch_uid=dispatch_uid)
+  models.signals.post_delete.connect(_model_data_changed_hook, sender=model,
+                                     dispatch_uid=dispatch_uid)
+  _watched_models.add(model)
+
+# The models whose signals are being listened to by watch_model_data.
+_watched_models = set()
+
+def _model_data_changed_hook(sender, **kwargs):
+  """Function to hook into the post-save/delete signals of watched models.
+
+  Invalidates the cached results of model menu options for the model.
+
+  """
+
+  bump_model_version(sender)
+
+# The (app label, model name) of models to watch once they've been loaded.
+_pending_models = set()
+
+def _watch_cached_models():
+  """Function to watch every model used by a model menu option that caches
+  its results, called when the app is loaded.
+
+  Models that haven't been loaded yet are watched as soon as they are (see
+  _watch_pending_model_hook).
+
+  """
+
+  try:
+    content_types = list(MenuOption.objects\
+                           .filter(option_type=MenuOption.MODEL_MENU_OPTION,
+                                   cache_timeout__isnull=False)\
+                           .values_list('content_type__app_label',
+                                        'content_type__model').distinct())
+  except DatabaseError, e:
+    # The tables haven't been created yet (e.g. during syncdb), so there's
+    # nothing cached to invalidate.
+    transaction.rollback_unless_managed()
+    return
+  for app_label, model_name in content_types:
+    if app_label is None:
+      continue
+    model = models.get_model(app_label, model_name, seed_cache=False)
+    if model is None:
+      _pending_models.add((app_label, model_name))
+    else:
+      watch_model_data(model)
+
+def _watch_pending_model_hook(sender, **kwargs):
+  """Function to hook into the class_prepared signal.
+
+  Watches models used by model menu options that cache their results that
+  were loaded after this app.
+
+  """
+
+  name = (sender._meta.app_label, sender._meta.object_name.lower())
+  if name in _pending_models:
+    _pending_models.discard(name)
+    watch_model_data(sender)
+
+def _menu_option_watch_model_hook(sender, **kwargs):
+  """Function to hook into the post-save model signal of menu options.
+
+  Watches the model of an option that caches its results.
+
+  """
+
+  menu_option = kwargs.get('instance')
+  if menu_option is not None and menu_option.cache_timeout is not None \
+    and menu_option.content_type_id is not None:
+    watch_model_data(menu_option.content_type.model_class())
+
+if getattr(settings, 'GDT_NAV_MODEL_CACHE_INVALIDATION', False):
+  models.signals.class_prepared.connect(_watch_pending_model_hook)
+  models.signals.post_save.connect(_menu_option_watch_model_hook,
+                                   sender=MenuOption)
+  _watch_cached_models()
+
+if hasattr(models.signals, 'm2m_changed'):
+  # Only available from django 1.2 onwards.
+  models.signals.m2m_changed.connect(_menu_option_m2m_changed_hook,
+                                     sender=MenuOption.permissions.through)
+  if Site._meta.installed:
+    models.signals.m2m_changed.connect(_menu_option_m2m_changed_hook,
+                                       sender=MenuOption.sites.through)
+  models.signals.m2m_changed.connect(_permissions_changed_hook,
+                                     sender=User.user_permissions.through)
+  models.signals.m2m_changed.connect(_permissions_changed_hook,
+                                     sender=User.groups.through)
+  models.signals.m2m_changed.connect(_permissions_changed_hook,
+                                     sender=Group.permissions.through)
+
+def _request_started_hook(sender, **kwargs):
+  """Function to hook into the request_started signal.
+
+  Defers version bumps until the request has finished, by which time any
+  changes it made have been committed, so that another request can't cache
+  the old data under the new version.
+
+  """
+
+  # Apply anything left over from a request that didn't finish cleanly.
+  flush_menu_version_bumps(all_levels=True)
+  defer_menu_version_bumps()
+request_started.connect(_request_started_hook)
+
+def _request_finished_hook(sender, **kwargs):
+  """Function to hook into the request_finished signal.
+
+  Applies the version bumps deferred while handling the request.
+
+  """
+
+  flush_menu_version_bumps(all_levels=True)
+request_finished.connect(_request_finished_hook)
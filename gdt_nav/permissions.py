@@ -0,0 +1,81 @@
+"""
+Cached permissions of users.
+
+Menu options with permissions attached are only shown to users that have
+them, and django loads a user's permissions with a couple of queries the
+first time they're needed on each request.  If the GDT_NAV_CACHE_PERMISSIONS
+setting is True then each user's permissions are kept in the django cache
+instead, keyed by the user's id and a version that's bumped whenever
+permissions are assigned to users or groups, users join or leave groups or
+groups or permissions change (see the signal hooks at the bottom of
+gdt_nav.models), so warm requests don't query them at all.
+
+Whether a user is active or a superuser is always taken from the user itself.
+Menu trees give each permission their options need a bit, so the permissions
+a user has are turned into a mask once and each option is checked against it
+with a single bitwise operation.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from gdt_nav.cache import get_permission_version, VERSION_TIMEOUT
+
+
+# The prefix used for the cache keys of users' permissions.
+PERMISSIONS_KEY_PREFIX = 'gdt_nav:permissions:'
+
+# The attribute of the user that their permissions are kept in for the rest
+# of the request.
+USER_PERMISSIONS = '_gdt_nav_permissions'
+
+
+def permission_caching_enabled():
+  """Return whether users' permissions should be cached between requests.
+
+  """
+
+  return getattr(settings, 'GDT_NAV_CACHE_PERMISSIONS', False)
+
+def get_user_permissions(user):
+  """Return the permissions of a user.
+
+  Keyword arguments:
+  user -- The user.
+
+  Returns:
+  A set of 'app_label.codename' strings, empty for anonymous and inactive
+  users.
+
+  """
+
+  if user.is_anonymous() or not user.is_active:
+    return set()
+  permissions = getattr(user, USER_PERMISSIONS, None)
+  if permissions is not None:
+    return permissions
+  if permission_caching_enabled():
+    key = '%s%s:%s' % (PERMISSIONS_KEY_PREFIX, user.pk,
+                       get_permission_version())
+    permissions = cache.get(key)
+    if permissions is None:
+      permissions = user.get_all_permissions()
+      cache.set(key, permissions, VERSION_TIMEOUT)
+  else:
+    permissions = user.get_all_permissions()
+  setattr(user, USER_PERMISSIONS, permissions)
+  return permissions
+
+def get_user_permission_mask(user, tree):
+  """Return the mask of the permissions a user has out of those in a tree.
+
+  Anonymous users get every bit set since they're only restricted by the
+  options shown to anonymous users.
+
+  Keyword arguments:
+  user -- The user.
+  tree -- The gdt_nav.tree.MenuTree.
+
+  """
+
+  if user.is_anonymous() or (user.is_active and user.is_superuser):
+    return tree.permission_mask(None)
+  return tree.permission_mask(get_user_permissions(user))
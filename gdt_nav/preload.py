@@ -0,0 +1,71 @@
+"""
+Preloading the menu groups a page needs.
+
+Each menu_as_* tag on a page normally looks up its menu group and loads its
+tree on its own.  Declaring the groups a page uses up front, either with the
+preload_menus template tag or by listing them in the GDT_NAV_PRELOAD_MENUS
+setting and adding gdt_nav.context_processors.menus to
+TEMPLATE_CONTEXT_PROCESSORS, loads all of them at once: one query for the
+groups, one for all of their options and one for all of their permissions
+(less any trees that are already cached).  The tags then render from the
+preloaded data, sharing the request's url resolution and the user's
+permissions as usual.
+"""
+from gdt_nav.models import MenuGroup
+from gdt_nav.tree import load_menu_trees
+
+
+# The attributes of the request that preloaded groups and trees are kept in.
+REQUEST_GROUPS = '_gdt_nav_groups'
+REQUEST_TREES = '_gdt_nav_trees'
+
+
+def preload_menus(request, names):
+  """Load several menu groups and their trees for a request.
+
+  Keyword arguments:
+  request -- The request that the menus will be rendered for.
+  names -- The names of the menu groups.
+
+  """
+
+  if request is None:
+    return
+  groups = request.__dict__.setdefault(REQUEST_GROUPS, {})
+  trees = request.__dict__.setdefault(REQUEST_TREES, {})
+  names = [name for name in names if name not in groups]
+  if not names:
+    return
+  menu_groups = {}
+  for menu_group in MenuGroup.objects.filter(name__in=names):
+    menu_groups.setdefault(menu_group.name, []).append(menu_group)
+  loaded = []
+  for name in names:
+    # Names that don't identify exactly one group are left to the tags to
+    # deal with as usual.
+    if len(menu_groups.get(name, [])) == 1:
+      groups[name] = menu_groups[name][0]
+      loaded.append(groups[name])
+  trees.update(load_menu_trees(loaded))
+
+def get_preloaded_group(request, name):
+  """Return a menu group preloaded for a request, or None.
+
+  Keyword arguments:
+  request -- The request being rendered.
+  name -- The name of the menu group.
+
+  """
+
+  return getattr(request, REQUEST_GROUPS, {}).get(name)
+
+def get_preloaded_tree(request, menu_group):
+  """Return the tree of a menu group preloaded for a request, or None.
+
+  Keyword arguments:
+  request -- The request being rendered.
+  menu_group -- The menu group.
+
+  """
+
+  return getattr(request, REQUEST_TREES, {}).get(menu_group.pk)
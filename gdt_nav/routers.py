@@ -0,0 +1,95 @@
+"""
+Database routing for gdt_nav.
+
+To read menus from a replica database set GDT_NAV_READ_DATABASE to the alias
+of the replica and add 'gdt_nav.routers.MenuRouter' to DATABASE_ROUTERS.  The
+router sends reads of gdt_nav's models (along with anything fetched through
+them, such as the permissions and content types of options) to the replica
+and writes to the primary database.  The querysets of model menu options are
+sent to the replica by gdt_nav itself as the router only deals with gdt_nav's
+own models.
+
+For GDT_NAV_REPLICA_LAG seconds (default 10) after menu data changes, reads
+go to the primary database instead so that nothing caches the replica's old
+data against the new version of the menus (see gdt_nav.cache).
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from gdt_nav.cache import recently_changed
+
+
+class MenuRouter(object):
+  """A database router sending menu reads to GDT_NAV_READ_DATABASE.
+
+  """
+
+  def db_for_read(self, model, **hints):
+    """Route reads of menu data to the read database.
+
+    """
+
+    if _is_menu_data(model, hints):
+      return get_read_database()
+    return None
+
+  def db_for_write(self, model, **hints):
+    """Route writes of menu data to the primary database.
+
+    Objects read from the replica would otherwise be saved back to it.
+
+    """
+
+    if _is_menu_data(model, hints):
+      return DEFAULT_DB_ALIAS
+    return None
+
+  def allow_relation(self, obj1, obj2, **hints):
+    """Allow relations between menu data read from different databases.
+
+    """
+
+    if _is_menu_data(obj1.__class__, {}) or _is_menu_data(obj2.__class__, {}):
+      return True
+    return None
+
+  def allow_syncdb(self, db, model):
+    """Leave the decision of where to create tables to other routers.
+
+    """
+
+    return None
+
+
+def get_read_database(model=None):
+  """Return the alias of the database that menu data should be read from.
+
+  Keyword arguments:
+  model -- The model being read for a model menu option, or None for the
+           menu data itself (default None).
+
+  Returns:
+  The alias of the database, or None to use the default routing.
+
+  """
+
+  alias = getattr(settings, 'GDT_NAV_READ_DATABASE', None)
+  if alias is None:
+    return None
+  if recently_changed(model):
+    # The replica may not have the change yet.
+    return DEFAULT_DB_ALIAS
+  return alias
+
+def _is_menu_data(model, hints):
+  """Helper function to check if a query is for menu data.
+
+  Keyword arguments:
+  model -- The model class being queried.
+  hints -- The hints given to the router.
+
+  """
+
+  if model._meta.app_label == 'gdt_nav':
+    return True
+  instance = hints.get('instance')
+  return instance is not None and instance._meta.app_label == 'gdt_nav'
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+
+# Sent after a menu has been rendered by one of the menu_as_* template tags
+# when GDT_NAV_INSTRUMENTATION is enabled.  The timings argument is a
+# dictionary mapping each stage of rendering (lookup, resolution, hierarchy and
+# render) to the number of seconds it took.
+menu_rendered = Signal(providing_args=['menu_group', 'request', 'timings',
+                                       'queries', 'cache_hits'])
@@ -0,0 +1,115 @@
+"""
+Sharing menu snapshots between the processes on a host.
+
+Each process keeps its own copy of the menu trees and compiled menus it has
+loaded, so with many worker processes per host every one of them has to fetch
+(or build) each menu after a deploy or a change.  If the GDT_NAV_SNAPSHOT_DIR
+setting names a directory on local disk then every tree and compiled menu
+that's loaded is also written there, and a process that doesn't have an up to
+date copy checks the directory before going to the django cache or the
+database, so the queries and the cache round trip are only paid for once per
+host.
+
+This is a plain file cache: each process reads and unpickles a snapshot into
+its own memory, the files just save the work of loading it.  Snapshots are
+replaced by writing a temporary file and renaming it over the old one, so
+readers always see a complete snapshot.  Each file starts with a header
+holding SNAPSHOT_FORMAT and the snapshot's key, and files with any other
+header (e.g. left behind by an older version of the code) are ignored and
+rewritten.  Snapshots hold the version they were built from in the same way
+as the cache so stale ones are simply ignored and rewritten too.
+"""
+import cPickle as pickle
+import os
+import tempfile
+
+from django.conf import settings
+
+
+# The version of the snapshot files, which must be increased whenever the
+# classes that are pickled into them change in an incompatible way.
+SNAPSHOT_FORMAT = 1
+
+
+def snapshots_enabled():
+  """Return whether snapshots should be shared through the file system.
+
+  """
+
+  return bool(getattr(settings, 'GDT_NAV_SNAPSHOT_DIR', None))
+
+def read_snapshot(key):
+  """Return the value of a snapshot, or None if there isn't one.
+
+  Keyword arguments:
+  key -- The cache key the value is stored under.
+
+  """
+
+  if not snapshots_enabled():
+    return None
+  try:
+    snapshot_file = open(_snapshot_path(key), 'rb')
+    try:
+      if snapshot_file.readline() != _snapshot_header(key):
+        # Written by an incompatible version of the code.
+        return None
+      return pickle.load(snapshot_file)
+    finally:
+      snapshot_file.close()
+  except Exception, e:
+    # There's no snapshot or it can't be unpickled.
+    return None
+
+def write_snapshot(key, value):
+  """Store the value of a snapshot.
+
+  Failures to write are ignored, the value is still held by the cache.
+
+  Keyword arguments:
+  key -- The cache key the value is stored under.
+  value -- The value to store, which must be picklable.
+
+  """
+
+  if not snapshots_enabled():
+    return
+  path = _snapshot_path(key)
+  try:
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                             prefix='.tmp')
+    try:
+      temp_file = os.fdopen(descriptor, 'wb')
+      try:
+        temp_file.write(_snapshot_header(key))
+        pickle.dump(value, temp_file, pickle.HIGHEST_PROTOCOL)
+      finally:
+        temp_file.close()
+      os.chmod(temp_path, 0644)
+      os.rename(temp_path, path)
+    except:
+      os.unlink(temp_path)
+      raise
+  except (IOError, OSError, pickle.PicklingError), e:
+    pass
+
+def _snapshot_header(key):
+  """Helper function to generate the first line of a snapshot file.
+
+  Keyword arguments:
+  key -- The cache key the value is stored under.
+
+  """
+
+  return 'gdt_nav snapshot %s %s\n' % (SNAPSHOT_FORMAT, key)
+
+def _snapshot_path(key):
+  """Helper function to generate the path of the file for a snapshot.
+
+  Keyword arguments:
+  key -- The cache key the value is stored under.
+
+  """
+
+  return os.path.join(settings.GDT_NAV_SNAPSHOT_DIR,
+                      key.replace(':', '_') + '.snapshot')
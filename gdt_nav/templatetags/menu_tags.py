@@ -1,6 +1,14 @@
 from django import template
+from django.core.urlresolvers import reverse, NoReverseMatch
 from django.template import RequestContext
+from django.utils.html import escape
+from django.utils.http import urlencode
+from gdt_nav.compiler import compiled_menus_enabled, get_compiled_menu
+from gdt_nav.concurrency import submit
+from gdt_nav.instrumentation import MenuTimer, record_cache_hit
 from gdt_nav.models import MenuGroup, MenuOption
+from gdt_nav.preload import get_preloaded_group, preload_menus
+from gdt_nav.tree import MenuNode
 
 
 register = template.Library()
@@ -10,6 +18,7 @@ register = template.Library()
 _menu_level_template = """menu_level_%s"""
 _item_template = """<%(item_tag)s%(menu_option_id)s class="menu_item %(menu_level)s%(selected)s">%(item)s%(sub_list)s</%(item_tag)s>"""
 _group_template = """<%(group_tag)s class="%(menu_level)s">%(group)s</%(group_tag)s>"""
+_placeholder_template = """<%(group_tag)s class="%(menu_level)s menu_placeholder" data-menu-url="%(url)s"></%(group_tag)s>"""
 
 @register.inclusion_tag("admin_menu_as_tag.html", takes_context=True)
 def admin_menu_as_tag(context, menu_root, spaces='', last_item=True):
@@ -18,28 +27,29 @@ def admin_menu_as_tag(context, menu_root, spaces='', last_item=True):
 
   Keyword arguments:
   context -- The current template context
-  menu_root -- The collection of menu_options to convert, or the name of the
-               desired collection.
+  menu_root -- The collection of menu_options to convert (a menu group or a
+               node of a menu tree), or the name of the desired collection.
   spaces -- A string representing the menu hierarchy drawing structure of the
             parent element.
   last_item -- Is this the last item of a group of menu options.
 
 
   """
-  # If neither a menu group nor a menu option has been passed in then assume
-  # it's a string naming the group to use and attempt to fetch it.
+  # If neither a menu group nor a menu node has been passed in then assume
+  # it's a string naming the group to use and attempt to fetch it.  The whole
+  # tree is loaded up front so that drawing it doesn't need any more queries.
   item = None
   if type(menu_root) == MenuGroup:
-    children = menu_root.menu_items.filter(parent__isnull=True).order_by('ordering')
-  elif type(menu_root) == MenuOption:
+    children = menu_root.load_tree(False).roots
+  elif type(menu_root) == MenuNode:
     item = menu_root
-    children = menu_root.menuoption_set.order_by('ordering')
+    children = menu_root.children
   else:
     try:
-      menu_root = MenuGroup.objects.get(name=menu_group)
-      children = menu_root.menu_items.filter(parent__isnull=True).order_by('ordering')
+      menu_root = MenuGroup.objects.get(name=menu_root)
+      children = menu_root.load_tree(False).roots
     except:
-      children = MenuGroup.objects.empty()
+      children = []
   space_string = spaces
   first_spaces = spaces + "&#9475;" + "<br />"
   second_spaces = "<br />" + spaces
@@ -51,7 +61,7 @@ def admin_menu_as_tag(context, menu_root, spaces='', last_item=True):
     space_string += "&#9507;"
     child_space_string = spaces + "&#9475;"
     second_spaces += "&#9475;"
-  if children.count() > 0:
+  if children:
     space_string += "&#9523;"
     second_spaces += "&#9475;"
   else:
@@ -67,31 +77,34 @@ def admin_menu_as_tag(context, menu_root, spaces='', last_item=True):
          }
 
 @register.inclusion_tag("menu_as_tag.html", takes_context=True)
-def menu_as_ul(context, menu_group):
+def menu_as_ul(context, menu_group, depth=None):
   """
   Return a menu group as an html structure based around nested unordered lists.
 
   Keyword arguments:
   context -- The current template context
   menu_group -- The collection of menu_options to convert.
+  depth -- The number of levels to render inline (default None, all of them).
 
   """
-  return menu_as_tag(context, menu_group, "ul", "li")
+  return menu_as_tag(context, menu_group, "ul", "li", depth)
 
 @register.inclusion_tag("menu_as_tag.html", takes_context=True)
-def menu_as_div(context, menu_group):
+def menu_as_div(context, menu_group, depth=None):
   """
   Return a menu group as an html structure based around nested divs.
 
   Keyword arguments:
   context -- The current template context
   menu_group -- The collection of menu_options to convert.
+  depth -- The number of levels to render inline (default None, all of them).
 
   """
-  return menu_as_tag(context, menu_group, "div", "div")
+  return menu_as_tag(context, menu_group, "div", "div", depth)
 
 @register.inclusion_tag("menu_as_tag.html", takes_context=True)
-def menu_as_tag(context, menu_group, group_tag="ul", item_tag="li"):
+def menu_as_tag(context, menu_group, group_tag="ul", item_tag="li",
+                depth=None):
   """
   Return a menu group as an html structure based on the tag names passed in.
 
@@ -101,26 +114,130 @@ def menu_as_tag(context, menu_group, group_tag="ul", item_tag="li"):
                 desired collection.
   group_tag -- The tag to surround collections of menu items with (default ul).
   item_tag -- The tag to surround individual menu items with (default li).
+  depth -- The number of levels to render inline, deeper sub menus are left
+           as placeholders to be fetched from the menu_fragment view
+           (default None, all of them).
 
   """
-  # If a menu group's not been passed in then assume it's a string naming the
-  # group to use and attempt to fetch it.
-  if type(menu_group) != MenuGroup:
-    try:
-      menu_group = MenuGroup.objects.get(name=menu_group)
-    except:
-      return { "menu_string":"", }
+  return { "menu_string":render_menu(context.get('request'), menu_group,
+                                     group_tag, item_tag, depth=depth), }
+
+def arender_menu(request, menu_group, group_tag="ul", item_tag="li",
+                 depth=None):
+  """
+  Start rendering a menu group in the background.
+
+  The menu is rendered in another thread with the independent queries made
+  concurrently (see gdt_nav.concurrency) so that the caller isn't blocked.
+
+  Keyword arguments:
+  request -- The request to render the menu for.
+  menu_group -- The collection of menu_options to convert, or the name of the
+                desired collection.
+  group_tag -- The tag to surround collections of menu items with (default ul).
+  item_tag -- The tag to surround individual menu items with (default li).
+  depth -- The number of levels to render inline (default None, all of them).
+
+  Returns:
+  A MenuFuture whose result is the rendered menu.
 
-  # Generate the menu hierarchy, a list of selected items and a list of the
-  # named parameters that were used to form the url.
-  hierarchies, selected_items, selected_params = menu_group.generate_hierarchy(context.get('request'))
-  # Generate the html structure for the items just generated.
-  menu_string = _generate_menu_string(hierarchies, "ROOT", selected_items,
-                                      selected_params, group_tag, item_tag)
-  return { "menu_string":menu_string, }
+  """
+  return submit(render_menu, request, menu_group, group_tag, item_tag, True,
+                depth)
+
+def render_menu(request, menu_group, group_tag="ul", item_tag="li",
+                concurrent=None, depth=None):
+  """
+  Return a menu group as an html string based on the tag names passed in.
+
+  Keyword arguments:
+  request -- The request to render the menu for.
+  menu_group -- The collection of menu_options to convert, or the name of the
+                desired collection.
+  group_tag -- The tag to surround collections of menu items with (default ul).
+  item_tag -- The tag to surround individual menu items with (default li).
+  concurrent -- Whether to make the queries needed concurrently, or None to use
+                the GDT_NAV_CONCURRENT_QUERIES setting (default None).
+  depth -- The number of levels to render inline, deeper sub menus are left
+           as placeholders (default None, all of them).
+
+  """
+  timer = MenuTimer(request)
+  try:
+    # If a menu group's not been passed in then assume it's a string naming the
+    # group to use and attempt to fetch it.
+    timer.stage('lookup')
+    if depth is not None:
+      depth = int(depth)
+    if compiled_menus_enabled() and depth is None:
+      # Static menus can be looked up without touching the database.
+      compiled = get_compiled_menu(menu_group)
+      if compiled is not None and compiled.static:
+        timer.stage('render')
+        menu_string = compiled.render(request, group_tag, item_tag)
+        if menu_string is not None:
+          record_cache_hit()
+          return menu_string
+    if type(menu_group) != MenuGroup:
+      preloaded = get_preloaded_group(request, menu_group)
+      if preloaded is not None:
+        menu_group = preloaded
+      else:
+        try:
+          menu_group = MenuGroup.objects.get(name=menu_group)
+        except:
+          return ""
+
+    # Work out the name and keyword arguments of the current url.
+    timer.stage('resolution')
+    url_parts = menu_group._fetch_current_url_parts(request)
+    # Generate the menu hierarchy, a list of selected items and a list of the
+    # named parameters that were used to form the url.
+    timer.stage('hierarchy')
+    hierarchies, selected_items, selected_params = menu_group.generate_hierarchy(request, url_parts, concurrent)
+    # Generate the html structure for the items just generated.
+    timer.stage('render')
+    fragment = None
+    if depth is not None:
+      fragment = (menu_group.name, request.path, depth)
+    return _generate_menu_string(hierarchies, "ROOT", selected_items,
+                                 selected_params, group_tag, item_tag,
+                                 depth=depth, fragment=fragment)
+  finally:
+    timer.finish(menu_group)
+
+class PreloadMenusNode(template.Node):
+  """
+  Template node that preloads menu groups for the current request.
+
+  """
+  def __init__(self, names):
+    self.names = names
+
+  def render(self, context):
+    preload_menus(context.get('request'),
+                  [name.resolve(context) for name in self.names])
+    return ""
+
+@register.tag(name="preload_menus")
+def do_preload_menus(parser, token):
+  """
+  Preload the menu groups that a page is going to render.
+
+  Usage: {% preload_menus "top menu" "side menu" %}
+
+  Place this before any of the menu_as_* tags for the groups named so that
+  they're all loaded at once rather than one at a time.
+
+  """
+  bits = token.split_contents()[1:]
+  if not bits:
+    raise template.TemplateSyntaxError("preload_menus takes at least one menu group name")
+  return PreloadMenusNode([parser.compile_filter(bit) for bit in bits])
 
 def _generate_menu_string(hierarchies, hier_index, selected_items,
-                          selected_params, group_tag, item_tag, level=0):
+                          selected_params, group_tag, item_tag, level=0,
+                          depth=None, fragment=None):
   """
   Helper function to generate a string representation of a menu hierarchy.
 
@@ -137,6 +254,10 @@ def _generate_menu_string(hierarchies, hier_index, selected_items,
   group_tag -- The tag to surround collections of menu items with.
   item_tag -- The tag to surround individual menu items with.
   level -- The depth of the menu (default 0)
+  depth -- The level at which sub menus are replaced by placeholders
+           (default None, never).
+  fragment -- A tuple of (menu group name, path, levels) used to point the
+              placeholders at the menu_fragment view (default None).
 
   """
   # Define the class name for the current menu depth.
@@ -198,9 +319,16 @@ def _generate_menu_string(hierarchies, hier_index, selected_items,
       # be displayed then recursively call this function with the option as the
       # new hierarchy index and the depth at the next level down.
       if (opt in hierarchies) and opt.show_hierarchy(opt_selected):
-        sub_list = _generate_menu_string(hierarchies, opt, selected_items,
-                                         selected_params, group_tag,
-                                         item_tag, level=level + 1 )
+        sub_list = None
+        if depth is not None and level + 1 >= depth and hierarchies[opt]:
+          # Leave the sub menu to be fetched when it's wanted.
+          sub_list = _generate_placeholder(opt, fragment, group_tag,
+                                           item_tag, level + 1)
+        if sub_list is None:
+          sub_list = _generate_menu_string(hierarchies, opt, selected_items,
+                                           selected_params, group_tag,
+                                           item_tag, level=level + 1,
+                                           depth=depth, fragment=fragment)
         string_params['sub_list'] = sub_list
       # Add the item string to the list of sub items.
       sub_items.append(_item_template % string_params)
@@ -211,3 +339,37 @@ def _generate_menu_string(hierarchies, hier_index, selected_items,
                    'menu_level':menu_level,
                   }
   return _group_template % string_params
+
+def _generate_placeholder(option, fragment, group_tag, item_tag, level):
+  """
+  Helper function to generate a placeholder for a sub menu.
+
+  Keyword arguments:
+  option -- The menu option whose sub menu is being left out.
+  fragment -- A tuple of (menu group name, path, levels) for the menu_fragment
+              view.
+  group_tag -- The tag to surround collections of menu items with.
+  item_tag -- The tag to surround individual menu items with.
+  level -- The depth of the sub menu.
+
+  Returns:
+  The placeholder string, or None if the menu_fragment view isn't available
+  (in which case the sub menu should be rendered inline).
+
+  """
+  if fragment is None:
+    return None
+  group_name, path, levels = fragment
+  try:
+    url = reverse('gdt_nav_menu_fragment',
+                  kwargs={'group_name': group_name, 'option_id': option.pk})
+  except NoReverseMatch, e:
+    return None
+  url = '%s?%s' % (url, urlencode({'path': path, 'depth': levels,
+                                   'group_tag': group_tag,
+                                   'item_tag': item_tag}))
+  string_params = {'group_tag':group_tag,
+                   'menu_level':_menu_level_template % level,
+                   'url':escape(url),
+                  }
+  return _placeholder_template % string_params
@@ -0,0 +1,344 @@
+"""
+Tests for gdt_nav.
+
+The tests use their own urls (see urlpatterns below) so that they don't
+depend on the project's urlconf.
+"""
+import re
+
+from django.conf.urls.defaults import include, patterns, url
+from django.contrib import admin
+from django.contrib.auth.models import Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.http import HttpResponse, HttpResponseNotFound
+from django.test import TestCase
+from django.utils import simplejson
+# Registers the menu models with the admin site for the reorder view.
+import gdt_nav.admin
+from gdt_nav.bulk import BulkChangeError, move_menu_options, \
+                         reorder_menu_options
+from gdt_nav.cache import get_menu_version
+from gdt_nav.models import MenuGroup, MenuOption
+
+
+def _view(request, **kwargs):
+  return HttpResponse('')
+
+def _not_found(request):
+  return HttpResponseNotFound('')
+
+handler404 = _not_found
+
+urlpatterns = patterns('',
+  url(r'^$', _view, name='gdt_nav_test_home'),
+  url(r'^pages/(?P<slug>[\w-]+)/$', _view, name='gdt_nav_test_page'),
+  (r'^menus/', include('gdt_nav.urls')),
+  (r'^admin/', include(admin.site.urls)),
+)
+
+
+def _create_option(menu_group, name, parent=None, ordering=1, **kwargs):
+  """Helper function to create a named url option shown to everyone.
+
+  Keyword arguments:
+  menu_group -- The menu group to add the option to.
+  name -- The name of the option.
+  parent -- The option to put the option under (default None).
+  ordering -- The ordering of the option (default 1).
+  kwargs -- Any other fields of the option.
+
+  """
+
+  fields = {'option_type': MenuOption.NAMED_URL_MENU_OPTION,
+            'url_name': 'gdt_nav_test_home',
+            'alt_text': name,
+            'show_to_anonymous': True,
+            'show_to_authenticated': True,
+            'show_to_staff': True,
+           }
+  fields.update(kwargs)
+  option = MenuOption.objects.create(menu_group=menu_group, name=name,
+                                     parent=parent, ordering=ordering,
+                                     **fields)
+  option.sites.add(Site.objects.get_current())
+  return option
+
+
+class MoveMenuOptionsTest(TestCase):
+  urls = 'gdt_nav.tests'
+
+  def setUp(self):
+    self.main = MenuGroup.objects.create(name='main')
+    self.side = MenuGroup.objects.create(name='side')
+    self.target = _create_option(self.side, 'Target')
+    self.home = _create_option(self.main, 'Home')
+    self.child = _create_option(self.main, 'Child', parent=self.home)
+    self.grandchild = _create_option(self.main, 'Grandchild',
+                                     parent=self.child)
+    self.other = _create_option(self.main, 'Other', ordering=2)
+
+  def _position(self, option):
+    """Helper function to return the group and parent of an option.
+
+    """
+
+    option = MenuOption.objects.get(pk=option.pk)
+    return option.menu_group_id, option.parent_id
+
+  def test_move_with_sub_menu(self):
+    moved = move_menu_options([self.home.pk], self.side, self.target)
+    self.assertEqual(moved, 1)
+    self.assertEqual(self._position(self.home),
+                     (self.side.pk, self.target.pk))
+    self.assertEqual(self._position(self.child), (self.side.pk, self.home.pk))
+    self.assertEqual(self._position(self.grandchild),
+                     (self.side.pk, self.child.pk))
+    self.assertEqual(self._position(self.other), (self.main.pk, None))
+
+  def test_move_with_selected_child(self):
+    move_menu_options([self.home.pk, self.child.pk], self.side, self.target)
+    self.assertEqual(self._position(self.home),
+                     (self.side.pk, self.target.pk))
+    self.assertEqual(self._position(self.child), (self.side.pk, self.home.pk))
+
+  def test_move_with_selected_grandchild(self):
+    # The grandchild's parent isn't selected but is moved along with Home, so
+    # the grandchild has to stay under it.
+    moved = move_menu_options([self.home.pk, self.grandchild.pk], self.side,
+                              self.target)
+    self.assertEqual(moved, 1)
+    self.assertEqual(self._position(self.home),
+                     (self.side.pk, self.target.pk))
+    self.assertEqual(self._position(self.child), (self.side.pk, self.home.pk))
+    self.assertEqual(self._position(self.grandchild),
+                     (self.side.pk, self.child.pk))
+
+  def test_move_into_own_sub_menu(self):
+    self.assertRaises(BulkChangeError, move_menu_options, [self.home.pk],
+                      self.main, self.grandchild)
+    self.assertEqual(self._position(self.home), (self.main.pk, None))
+
+  def test_move_to_parent_in_other_group(self):
+    self.assertRaises(BulkChangeError, move_menu_options, [self.other.pk],
+                      self.main, self.target)
+
+
+class ReorderMenuOptionsTest(TestCase):
+  urls = 'gdt_nav.tests'
+
+  def setUp(self):
+    self.main = MenuGroup.objects.create(name='main')
+    self.first = _create_option(self.main, 'First', ordering=1)
+    self.second = _create_option(self.main, 'Second', ordering=2)
+    self.third = _create_option(self.main, 'Third', ordering=5)
+    self.child = _create_option(self.main, 'Child', parent=self.first,
+                                ordering=3)
+
+  def _names(self):
+    """Helper function to list the names of the top level options in order.
+
+    """
+
+    return [node.name for node in self.main.load_tree().roots]
+
+  def test_reorder(self):
+    version = get_menu_version(self.main.pk)
+    reorder_menu_options([self.third.pk, self.first.pk, self.second.pk])
+    self.assertEqual(self._names(), ['Third', 'First', 'Second'])
+    # The existing ordering values are shared out between the options.
+    self.assertEqual(sorted(MenuOption.objects.filter(parent=None)
+                                      .values_list('ordering', flat=True)),
+                     [1, 2, 5])
+    self.assertEqual(MenuOption.objects.get(pk=self.child.pk).ordering, 3)
+    self.assertEqual(get_menu_version(self.main.pk), version + 1)
+
+  def test_reorder_with_equal_orderings(self):
+    MenuOption.objects.filter(parent=None).update(ordering=4)
+    reorder_menu_options([self.second.pk, self.third.pk, self.first.pk])
+    self.assertEqual(self._names(), ['Second', 'Third', 'First'])
+
+  def test_reorder_needs_every_sibling(self):
+    self.assertRaises(BulkChangeError, reorder_menu_options,
+                      [self.second.pk, self.first.pk])
+    self.assertRaises(BulkChangeError, reorder_menu_options,
+                      [self.first.pk, self.second.pk, self.third.pk,
+                       self.child.pk])
+    self.assertRaises(BulkChangeError, reorder_menu_options,
+                      [self.first.pk, self.first.pk, self.third.pk])
+    self.assertEqual(self._names(), ['First', 'Second', 'Third'])
+
+  def test_reorder_view(self):
+    User.objects.create_superuser('admin', 'admin@example.com', 'password')
+    self.client.login(username='admin', password='password')
+    url = '/admin/gdt_nav/menuoption/reorder/'
+    self.assertEqual(self.client.get(url).status_code, 405)
+    response = self.client.post(url, {'option': [self.second.pk,
+                                                 self.first.pk]})
+    self.assertEqual(response.status_code, 400)
+    response = self.client.post(url, {'option': [self.second.pk,
+                                                 self.first.pk,
+                                                 self.third.pk]})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(self._names(), ['Second', 'First', 'Third'])
+
+
+class PaginationTest(TestCase):
+  urls = 'gdt_nav.tests'
+
+  def setUp(self):
+    self.main = MenuGroup.objects.create(name='main')
+    # Menu groups are used as the results, with plenty of equal names.
+    for name in ['b', 'a', 'c', 'a', 'b', 'a', 'c', 'b']:
+      MenuGroup.objects.create(name=name, notes='paged')
+    self.option = _create_option(
+                    self.main, 'Groups',
+                    option_type=MenuOption.MODEL_MENU_OPTION,
+                    url_name='gdt_nav_test_page',
+                    content_type=ContentType.objects.get_for_model(MenuGroup),
+                    manager='objects', query='notes=paged', url_id='slug',
+                    model_id='pk', label_field='name', result_limit=3,
+                    paginate=True)
+
+  def _walk(self, order_by):
+    """Helper function to fetch every page of the option's results.
+
+    Keyword arguments:
+    order_by -- The ordering to give the option.
+
+    Returns:
+    A tuple of (the ids of the results in the order they were paged through,
+    the ids in the order the whole query returns them).
+
+    """
+
+    self.option.order_by = order_by
+    self.option.save()
+    option = MenuOption.objects.get(pk=self.option.pk)
+    results = option._fetch_results({})
+    self.assertEqual(len(results), 4)
+    results = results[:3]
+    seen = [pk for pk, name in results]
+    more = True
+    while more:
+      results, more = option.fetch_page({}, seen[-1])
+      self.assertTrue(len(results) <= 3)
+      seen.extend([pk for pk, name in results])
+    expected = list(MenuGroup.objects.filter(notes='paged')
+                                     .order_by(*option._ordering())
+                                     .values_list('pk', flat=True))
+    return seen, expected
+
+  def test_pages_with_ties(self):
+    seen, expected = self._walk('name')
+    self.assertEqual(seen, expected)
+
+  def test_pages_descending(self):
+    seen, expected = self._walk('-name')
+    self.assertEqual(seen, expected)
+    seen, expected = self._walk('-name,-pk')
+    self.assertEqual(seen, expected)
+
+  def test_more_link(self):
+    response = self.client.get('/menus/main/json/', {'path': '/'})
+    items = simplejson.loads(response.content)['items']
+    self.assertEqual([item['text'] for item in items],
+                     ['b', 'a', 'c', 'more...'])
+    more_url = items[-1]['url']
+    response = self.client.get(more_url)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(len(re.findall('menu_more_item', response.content)), 3)
+    self.assertFalse('%(classes)s' in response.content)
+    # The arguments of the link can't be tampered with.
+    response = self.client.get(more_url.replace('after=', 'after=1'))
+    self.assertEqual(response.status_code, 404)
+    response = self.client.get(re.sub('&sig=.*', '', more_url))
+    self.assertEqual(response.status_code, 404)
+
+
+class MenuVersionTest(TestCase):
+  urls = 'gdt_nav.tests'
+
+  def setUp(self):
+    self.main = MenuGroup.objects.create(name='main')
+    self.home = _create_option(self.main, 'Home')
+
+  def _get_menu(self, etag=None):
+    """Helper function to fetch the main menu as JSON.
+
+    Keyword arguments:
+    etag -- The ETag to revalidate, or None (default None).
+
+    """
+
+    headers = {}
+    if etag is not None:
+      headers['HTTP_IF_NONE_MATCH'] = etag
+    return self.client.get('/menus/main/json/', {'path': '/'}, **headers)
+
+  def test_change_bumps_version(self):
+    version = get_menu_version(self.main.pk)
+    self.home.name = 'Start'
+    self.home.save()
+    self.assertEqual(get_menu_version(self.main.pk), version + 1)
+    self.assertEqual([node.name for node in self.main.load_tree().nodes],
+                     ['Start'])
+
+  def test_change_invalidates_etag(self):
+    response = self._get_menu()
+    self.assertEqual(response.status_code, 200)
+    etag = response['ETag']
+    self.assertEqual(self._get_menu(etag).status_code, 304)
+    self.home.name = 'Start'
+    self.home.save()
+    response = self._get_menu(etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response['ETag'], etag)
+    self.assertTrue('Start' in response.content)
+
+
+class PermissionTest(TestCase):
+  urls = 'gdt_nav.tests'
+
+  def setUp(self):
+    self.main = MenuGroup.objects.create(name='main')
+    self.permission = Permission.objects.get(codename='change_menugroup')
+    _create_option(self.main, 'Public')
+    restricted = _create_option(self.main, 'Restricted', ordering=2,
+                                show_to_anonymous=False)
+    restricted.permissions.add(self.permission)
+    _create_option(self.main, 'Staff', ordering=3, show_to_anonymous=False,
+                   show_to_authenticated=False)
+    self.user = User.objects.create_user('user', 'user@example.com',
+                                         'password')
+
+  def _names(self, login=True):
+    """Helper function to list the options the user can see.
+
+    """
+
+    if login:
+      self.client.login(username='user', password='password')
+    response = self.client.get('/menus/main/json/', {'path': '/'})
+    return [item['text'] for item in
+            simplejson.loads(response.content)['items']]
+
+  def test_anonymous(self):
+    self.assertEqual(self._names(login=False), ['Public'])
+
+  def test_without_permission(self):
+    self.assertEqual(self._names(), ['Public'])
+
+  def test_with_permission(self):
+    self.user.user_permissions.add(self.permission)
+    self.assertEqual(self._names(), ['Public', 'Restricted'])
+
+  def test_staff(self):
+    self.user.is_staff = True
+    self.user.save()
+    self.assertEqual(self._names(), ['Public', 'Staff'])
+
+  def test_superuser(self):
+    self.user.is_superuser = True
+    self.user.save()
+    self.assertEqual(self._names(), ['Public', 'Restricted'])
@@ -0,0 +1,389 @@
+"""
+Lightweight trees of menu options.
+
+MenuGroup.load_tree fetches all of a group's options along with the
+permissions attached to them in two queries and turns them into MenuNode
+objects.  Nodes hold everything needed to render a menu, refer to their
+parent and children directly rather than through lazy relations, and share
+MenuOption's rendering methods, so once a tree has been loaded nothing
+touches the ORM other than evaluating the querysets of model menu options.
+
+Trees are cached (in the django cache and in a per-process dictionary) in a
+compact form, a list of tuples of each option's field values and permission
+names, along with the version of the menu data they were loaded from and the
+tree's indexes (see index_rows), which are built once when the tree is
+queried rather than every time it's loaded.  A fresh set of nodes is built
+from the compact form every time a tree is loaded since nodes are given
+per-request state while rendering.  Trees and nodes pickle to the same
+compact form.  The compact form is also shared
+between the processes on a host when GDT_NAV_SNAPSHOT_DIR is set (see
+gdt_nav.snapshots).
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from gdt_nav.cache import get_menu_versions, VERSION_TIMEOUT
+from gdt_nav.instrumentation import record_cache_hit
+from gdt_nav.models import MenuOption
+from gdt_nav.snapshots import read_snapshot, write_snapshot
+
+
+# The fields of MenuOption that are copied onto nodes.
+NODE_FIELDS = ('id', 'menu_group_id', 'parent_id', 'option_type', 'name',
+               'alt_text', 'menu_option_id', 'ordering', 'show_to_anonymous',
+               'show_to_authenticated', 'show_to_staff', 'url', 'url_name',
+               'content_type_id', 'manager', 'query', 'url_id', 'model_id',
+               'order_by', 'result_limit', 'label_field', 'select_related',
+               'cache_timeout', 'paginate')
+
+# The names to fetch NODE_FIELDS by in a values_list query.
+_QUERY_FIELDS = ('id', 'menu_group', 'parent', 'option_type', 'name',
+                 'alt_text', 'menu_option_id', 'ordering', 'show_to_anonymous',
+                 'show_to_authenticated', 'show_to_staff', 'url', 'url_name',
+                 'content_type', 'manager', 'query', 'url_id', 'model_id',
+                 'order_by', 'result_limit', 'label_field', 'select_related',
+                 'cache_timeout', 'paginate')
+
+# The methods of MenuOption that nodes share.
+NODE_METHODS = ('__unicode__', '__str__', '__repr__', 'as_admin_link',
+                'as_link', 'as_non_link', 'as_data', 'can_generate',
+                'show_hierarchy', 'url_matches', 'prefetch_results',
+                '_fetch_queryset', '_generate_model_type_string',
+                '_generate_model_type_params', '_fetch_results',
+                '_results_cache_key', '_query_arguments', '_query_results',
+                '_generate_model_type_link', '_generate_named_link',
+                '_generate_more_link', '_ordering', '_result_values',
+                'fetch_page')
+
+# The prefix used for the cache keys of trees.
+TREE_KEY_PREFIX = 'gdt_nav:tree:'
+
+# The version of the compact form of trees, included in their cache keys so
+# that trees cached before NODE_FIELDS (or the indexes) last changed aren't
+# used.
+TREE_FORMAT = 3
+
+# Per-process store of the compact form of trees, keyed in the same way as
+# the cache and holding a tuple of (version, rows, indexes).
+_trees = {}
+
+
+class MenuNode(object):
+  """A menu option in a MenuTree.
+
+  Nodes are compared and hashed by identity, which is fine as long as every
+  node used to render a menu comes from the same tree.
+
+  """
+
+  __slots__ = NODE_FIELDS + ('parent', 'children', 'permissions',
+                             'permission_mask', '_prefetched_results')
+
+  # The model options of MenuOption, used by as_admin_link.
+  _meta = MenuOption._meta
+
+  def __init__(self, values, permissions=(), permission_mask=0):
+    """Create a node.
+
+    Keyword arguments:
+    values -- The values of the fields in NODE_FIELDS, in the same order.
+    permissions -- The permissions needed to see the option, as
+                   'app_label.codename' strings (default ()).
+    permission_mask -- The bits of the permissions in the tree's
+                       permission_bits (default 0).
+
+    """
+
+    for name, value in zip(NODE_FIELDS, values):
+      setattr(self, name, value)
+    self.parent = None
+    self.children = []
+    self.permissions = tuple(permissions)
+    self.permission_mask = permission_mask
+
+  def __getstate__(self):
+    return self.to_row()
+
+  def __setstate__(self, row):
+    self.__init__(row[:-1], row[-1])
+
+  def _get_pk(self):
+    return self.id
+  pk = property(_get_pk)
+
+  def _get_content_type(self):
+    if self.content_type_id is None:
+      return None
+    # Content types are cached by django so this rarely hits the database.
+    return ContentType.objects.get_for_id(self.content_type_id)
+  content_type = property(_get_content_type)
+
+  def get_option_type_display(self):
+    """Return the name of the type of menu option.
+
+    """
+
+    return dict(MenuOption.MODEL_TYPE_CHOICES).get(self.option_type,
+                                                   self.option_type)
+
+  def to_row(self):
+    """Return the compact form of the node.
+
+    Returns:
+    A tuple of the values of the fields in NODE_FIELDS followed by the tuple
+    of permissions.
+
+    """
+
+    return tuple([getattr(self, name) for name in NODE_FIELDS]) \
+      + (self.permissions,)
+
+for _name in NODE_METHODS:
+  setattr(MenuNode, _name, MenuOption.__dict__[_name])
+
+
+class MenuTree(object):
+  """All of the options of a menu group, linked together.
+
+  """
+
+  def __init__(self, group_id, nodes, indexes=None):
+    """Create a tree, linking the nodes to their parents and children.
+
+    Keyword arguments:
+    group_id -- The id of the menu group.
+    nodes -- The MenuNodes of the group, in the order they appear in the menu.
+    indexes -- The indexes of the tree as returned by index_rows, in which
+               case the nodes' permission masks must already be set, or None
+               to build them from the nodes (default None).
+
+    """
+
+    self.group_id = group_id
+    self.nodes = nodes
+    self.nodes_by_id = dict([(node.id, node) for node in nodes])
+    self.roots = []
+    if indexes is None:
+      indexes = index_rows(self.to_rows())
+      for node, mask in zip(nodes, indexes[2]):
+        node.permission_mask = mask
+    # The ids of the named and model options, keyed by their url name, so the
+    # options that could match a url are found without checking every option.
+    # Each permission used in the tree is given a bit, and each node a mask of
+    # the bits of the permissions it needs, so checking whether a user can see
+    # a node is a single bitwise operation (see permission_mask).  Both are
+    # shared with the cached form of the tree so mustn't be changed.
+    self.url_name_index, self.permission_bits = indexes[:2]
+    self._indexes = indexes
+    for node in nodes:
+      if node.parent_id is None:
+        self.roots.append(node)
+      elif node.parent_id in self.nodes_by_id:
+        node.parent = self.nodes_by_id[node.parent_id]
+        node.parent.children.append(node)
+
+  def __reduce__(self):
+    return (tree_from_rows, (self.group_id, self.to_rows(), self._indexes))
+
+  def permission_mask(self, permissions):
+    """Return the mask of the bits of a set of permissions.
+
+    A user with the permissions can see a node if the node's permission_mask
+    has no bits set that aren't in the returned mask.
+
+    Keyword arguments:
+    permissions -- The permissions, as a set of 'app_label.codename' strings,
+                   or None for every permission used in the tree.
+
+    """
+
+    mask = 0
+    for permission, bit in self.permission_bits.items():
+      if permissions is None or permission in permissions:
+        mask |= bit
+    return mask
+
+  def to_rows(self):
+    """Return the compact form of the tree, a list of MenuNode.to_row tuples.
+
+    """
+
+    return [node.to_row() for node in self.nodes]
+
+
+def tree_from_rows(group_id, rows, indexes=None):
+  """Build a MenuTree from its compact form.
+
+  Keyword arguments:
+  group_id -- The id of the menu group.
+  rows -- The compact form of the tree, as returned by MenuTree.to_rows.
+  indexes -- The indexes of the tree, as returned by index_rows, or None to
+             build them (default None).
+
+  """
+
+  if indexes is None:
+    indexes = index_rows(rows)
+  return MenuTree(group_id, [MenuNode(row[:-1], row[-1], mask)
+                             for row, mask in zip(rows, indexes[2])],
+                  indexes)
+
+def index_rows(rows):
+  """Build the indexes of a tree from its compact form.
+
+  Keyword arguments:
+  rows -- The compact form of the tree, as returned by MenuTree.to_rows.
+
+  Returns:
+  A tuple of (url_name_index, permission_bits, permission masks), the first
+  mapping the url names of the tree's named and model options to a frozenset
+  of their ids, the second mapping each permission used in the tree to its
+  bit and the last holding the mask of each row's permissions, in order.
+
+  """
+
+  id_index = NODE_FIELDS.index('id')
+  option_type_index = NODE_FIELDS.index('option_type')
+  url_name_index = NODE_FIELDS.index('url_name')
+  url_names = {}
+  permission_bits = {}
+  masks = []
+  for row in rows:
+    mask = 0
+    for permission in row[-1]:
+      if permission not in permission_bits:
+        permission_bits[permission] = 1 << len(permission_bits)
+      mask |= permission_bits[permission]
+    masks.append(mask)
+    if row[option_type_index] != MenuOption.ABSOLUTE_URL_MENU_OPTION \
+      and row[url_name_index]:
+      url_names.setdefault(row[url_name_index], set()).add(row[id_index])
+  url_names = dict([(url_name, frozenset(ids))
+                    for url_name, ids in url_names.items()])
+  return (url_names, permission_bits, tuple(masks))
+
+def load_menu_tree(menu_group, current_site_only=True):
+  """Load the MenuTree of a menu group, from the cache if it's up to date.
+
+  Keyword arguments:
+  menu_group -- The menu group to load.
+  current_site_only -- Whether to leave out options that aren't on the
+                       current site, when the sites app is installed
+                       (default True).
+
+  """
+
+  return load_menu_trees([menu_group], current_site_only)[menu_group.pk]
+
+def load_menu_trees(menu_groups, current_site_only=True):
+  """Load the MenuTrees of several menu groups at once.
+
+  Trees that aren't cached (or are out of date) are loaded together, with one
+  query for all of their options and one for all of their permissions.
+
+  Keyword arguments:
+  menu_groups -- The menu groups to load.
+  current_site_only -- Whether to leave out options that aren't on the
+                       current site, when the sites app is installed
+                       (default True).
+
+  Returns:
+  A dictionary mapping the ids of the menu groups to their MenuTrees.
+
+  """
+
+  # Grab the versions first so that any change made whilst loading causes the
+  # trees to be loaded again.
+  group_ids = [menu_group.pk for menu_group in menu_groups]
+  versions = get_menu_versions(group_ids)
+  keys = dict([(group_id, _tree_key(group_id, current_site_only))
+               for group_id in group_ids])
+  loaded = {}
+  missing = []
+  for group_id in group_ids:
+    cached = _trees.get(keys[group_id])
+    if cached is None or cached[0] != versions[group_id]:
+      # Another process on this host may have loaded the tree already.
+      cached = read_snapshot(keys[group_id])
+      if cached is not None and cached[0] == versions[group_id]:
+        _trees[keys[group_id]] = cached
+    if cached is not None and cached[0] == versions[group_id]:
+      record_cache_hit()
+      loaded[group_id] = cached
+    else:
+      missing.append(group_id)
+  if missing:
+    cached_trees = cache.get_many([keys[group_id] for group_id in missing])
+    uncached = []
+    for group_id in missing:
+      cached = cached_trees.get(keys[group_id])
+      if cached is not None and cached[0] == versions[group_id]:
+        record_cache_hit()
+        _trees[keys[group_id]] = cached
+        write_snapshot(keys[group_id], cached)
+        loaded[group_id] = cached
+      else:
+        uncached.append(group_id)
+    if uncached:
+      queried = _query_rows(uncached, current_site_only)
+      for group_id in uncached:
+        group_rows = queried.get(group_id, [])
+        cached = (versions[group_id], group_rows, index_rows(group_rows))
+        cache.set(keys[group_id], cached, VERSION_TIMEOUT)
+        _trees[keys[group_id]] = cached
+        write_snapshot(keys[group_id], cached)
+        loaded[group_id] = cached
+  return dict([(group_id, tree_from_rows(group_id, loaded[group_id][1],
+                                         loaded[group_id][2]))
+               for group_id in group_ids])
+
+def _tree_key(group_id, current_site_only):
+  """Helper function to generate the cache key for a tree.
+
+  Keyword arguments:
+  group_id -- The id of the menu group.
+  current_site_only -- Whether the tree only holds the current site's options.
+
+  """
+
+  site = 'all'
+  if current_site_only and Site._meta.installed:
+    site = settings.SITE_ID
+  return '%s%s:%s:%s' % (TREE_KEY_PREFIX, TREE_FORMAT, site, group_id)
+
+def _query_rows(group_ids, current_site_only):
+  """Helper function to fetch the compact form of trees from the database.
+
+  Keyword arguments:
+  group_ids -- The ids of the menu groups to load.
+  current_site_only -- Whether to leave out options that aren't on the
+                       current site.
+
+  Returns:
+  A dictionary mapping the ids of the menu groups to the compact form of
+  their trees (groups without any options are left out).
+
+  """
+
+  options = MenuOption.objects.filter(menu_group__in=group_ids)\
+                              .order_by('ordering')
+  if current_site_only and Site._meta.installed:
+    options = options.filter(sites__id__exact=settings.SITE_ID)
+  permissions = {}
+  links = MenuOption.permissions.through.objects\
+            .filter(menuoption__menu_group__in=group_ids)\
+            .values_list('menuoption', 'permission__content_type__app_label',
+                         'permission__codename')
+  for option_id, app_label, codename in links:
+    permissions.setdefault(option_id, []).append('%s.%s' % (app_label,
+                                                            codename))
+  rows = {}
+  # Equal values are shared between rows so that they're only pickled once
+  # (keyed by type as well, otherwise e.g. 1 and True would be merged).
+  shared = {}
+  for values in options.values_list(*_QUERY_FIELDS):
+    row = list(values) + [tuple(permissions.get(values[0], ()))]
+    rows.setdefault(values[1], []).append(
+      tuple([shared.setdefault((type(value), value), value) for value in row]))
+  return rows
@@ -0,0 +1,9 @@
+from django.conf.urls.defaults import patterns, url
+
+
+urlpatterns = patterns('gdt_nav.views',
+  url(r'^(?P<group_name>[^/]+)/json/$', 'menu_json', name='gdt_nav_menu_json'),
+  url(r'^(?P<group_name>[^/]+)/fragment/(?P<option_id>\d+)/$', 'menu_fragment',
+      name='gdt_nav_menu_fragment'),
+  url(r'^more/(?P<option_id>\d+)/$', 'menu_more', name='gdt_nav_menu_more'),
+)
@@ -0,0 +1,319 @@
+import copy
+
+from django.conf import settings
+from django.core.urlresolvers import get_script_prefix, Resolver404
+from django.http import Http404, HttpResponse, HttpResponseNotModified, \
+                        QueryDict
+from django.shortcuts import get_object_or_404
+from django.utils import simplejson
+from django.utils.cache import patch_vary_headers
+try:
+  from django.utils.crypto import constant_time_compare
+except ImportError, e:
+  # Only available from django 1.2 onwards.
+  def constant_time_compare(val1, val2):
+    return val1 == val2
+from django.utils.hashcompat import md5_constructor
+from django.utils.http import parse_etags, quote_etag
+from django.utils.translation import get_language, ugettext as _
+from gdt_nav.cache import get_menu_version
+from gdt_nav.models import MenuGroup, MenuOption, _audience_can_see, \
+                           _format_link, more_link_signature
+from gdt_nav.permissions import get_user_permission_mask, \
+                                get_user_permissions
+
+
+def menu_json(request, group_name):
+  """Return the menu hierarchy of a menu group as JSON.
+
+  The hierarchy is generated for the current user as if they were viewing the
+  path given in the 'path' GET parameter (defaulting to the path of this
+  view), so that client side code can render the menu without the rest of
+  the page.  A strong ETag is attached to the response allowing clients and
+  caches to revalidate with conditional requests.
+
+  Keyword arguments:
+  request -- The request object for this view.
+  group_name -- The name of the menu group to generate.
+
+  """
+
+  menu_group = get_object_or_404(MenuGroup, name=group_name)
+  path = request.GET.get('path') or request.path
+  if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+  # The results of model menu options may change without the menu data
+  # changing, so only menus without any can be identified by their version.
+  etag = None
+  if not menu_group.menu_items.filter(option_type=MenuOption.MODEL_MENU_OPTION).count():
+    etag = _menu_etag(request, menu_group, path)
+    if etag in if_none_match:
+      return _menu_json_response(HttpResponseNotModified(), etag)
+
+  menu_request = _request_for_path(request, path)
+  try:
+    hierarchies, selected_items, selected_params = menu_group.generate_hierarchy(menu_request)
+  except Resolver404, e:
+    # The path doesn't belong to this site so there's no menu for it.
+    raise Http404
+  menu_data = { 'group': menu_group.name,
+                'items': _generate_menu_data(hierarchies, "ROOT",
+                                             selected_items, selected_params),
+              }
+  content = simplejson.dumps(menu_data, separators=(',', ':'))
+  if etag is None:
+    etag = md5_constructor(content).hexdigest()
+    if etag in if_none_match:
+      return _menu_json_response(HttpResponseNotModified(), etag)
+  return _menu_json_response(HttpResponse(content, mimetype='application/json'),
+                             etag)
+
+def menu_fragment(request, group_name, option_id):
+  """Return the html of the sub menu of a menu option.
+
+  This fills in the placeholders left by the menu_as_* template tags when
+  they're given a depth.  The sub menu is generated in the same way as the
+  full menu would have been for the path given in the 'path' GET parameter,
+  so only options in the selected hierarchy that the user can see have sub
+  menus.  The 'depth' GET parameter limits the number of levels rendered
+  inline, deeper sub menus being left as placeholders again, and the
+  'group_tag' and 'item_tag' GET parameters give the tags to use (default ul
+  and li).
+
+  Keyword arguments:
+  request -- The request object for this view.
+  group_name -- The name of the menu group.
+  option_id -- The id of the menu option whose sub menu is wanted.
+
+  """
+
+  from gdt_nav.templatetags.menu_tags import _generate_menu_string
+
+  menu_group = get_object_or_404(MenuGroup, name=group_name)
+  path = request.GET.get('path') or request.path
+  group_tag = request.GET.get('group_tag', 'ul')
+  item_tag = request.GET.get('item_tag', 'li')
+  if not (group_tag.isalnum() and item_tag.isalnum()):
+    raise Http404
+  try:
+    levels = int(request.GET.get('depth', ''))
+  except ValueError, e:
+    levels = None
+  menu_request = _request_for_path(request, path)
+  try:
+    hierarchies, selected_items, selected_params = menu_group.generate_hierarchy(menu_request)
+  except Resolver404, e:
+    raise Http404
+  for option in hierarchies:
+    if option != "ROOT" and option.pk == int(option_id):
+      break
+  else:
+    # The option isn't expanded for this path (or can't be seen).
+    raise Http404
+  level = 1
+  parent = option.parent
+  while parent is not None:
+    level += 1
+    parent = parent.parent
+  depth = None
+  fragment = None
+  if levels is not None:
+    depth = level + levels
+    fragment = (menu_group.name, path, levels)
+  content = _generate_menu_string(hierarchies, option, selected_items,
+                                  selected_params, group_tag, item_tag,
+                                  level=level, depth=depth, fragment=fragment)
+  response = HttpResponse(content, mimetype='text/html')
+  patch_vary_headers(response, ('Cookie',))
+  return response
+
+def menu_more(request, option_id):
+  """Return the html of the next page of results of a paginated model option.
+
+  This is where the 'more...' links of paginated model menu options lead.
+  The 'after' GET parameter holds the model_id value of the last result shown
+  and the 'params' GET parameter the url keyword arguments the option was
+  generated with, both signed by the 'sig' GET parameter.  The results are returned as a series of item tags (named
+  by the 'item_tag' GET parameter, default li) followed by another 'more...'
+  link if there are still more results.
+
+  Keyword arguments:
+  request -- The request object for this view.
+  option_id -- The id of the model menu option.
+
+  """
+
+  menu_option = get_object_or_404(MenuOption, pk=option_id, paginate=True,
+                                  option_type=MenuOption.MODEL_MENU_OPTION)
+  item_tag = request.GET.get('item_tag', 'li')
+  after = request.GET.get('after')
+  params = request.GET.get('params', '')
+  if after is None or not item_tag.isalnum():
+    raise Http404
+  if not constant_time_compare(request.GET.get('sig', ''),
+                               more_link_signature(menu_option.pk, params,
+                                                   after)):
+    # The arguments weren't generated by a 'more...' link.
+    raise Http404
+  url_params = dict([(str(name), value) for name, value
+                     in QueryDict(params).items()])
+  tree = menu_option.menu_group.load_tree()
+  option = tree.nodes_by_id.get(menu_option.pk)
+  if option is None:
+    # The option isn't on the current site.
+    raise Http404
+  # The option and all of its ancestors must be visible to the user.
+  user = request.user
+  user_mask = get_user_permission_mask(user, tree)
+  ancestor = option
+  while ancestor is not None:
+    if not _audience_can_see(user, ancestor) \
+      or ancestor.permission_mask & ~user_mask \
+      or not ancestor.can_generate(url_params):
+      raise Http404
+    ancestor = ancestor.parent
+  results, more = option.fetch_page(url_params, after)
+  items = []
+  for model_value, link_text in results:
+    url = option._generate_model_type_link(model_value, url_params)
+    if url is not None:
+      string_params = { 'url': url,
+                        'title': _(option.alt_text),
+                        'link_text': link_text,
+                      }
+      items.append((_format_link(MenuOption.link_template, string_params),
+                    'menu_more_item'))
+  more_url = None
+  if more:
+    more_url = option._generate_more_link(results[-1][0], url_params)
+  if more_url is not None:
+    string_params = { 'url': more_url,
+                      'title': _(option.alt_text),
+                      'link_text': _('more...'),
+                    }
+    items.append((_format_link(MenuOption.link_template, string_params),
+                  'menu_more'))
+  content = '\n'.join(['<%s class="menu_item %s">%s</%s>' %
+                        (item_tag, item_class, item % {'classes': ''},
+                         item_tag)
+                        for item, item_class in items])
+  response = HttpResponse(content, mimetype='text/html')
+  patch_vary_headers(response, ('Cookie',))
+  return response
+
+def _menu_json_response(response, etag):
+  """Helper function to add the caching headers to a menu_json response.
+
+  Keyword arguments:
+  response -- The response to add the headers to.
+  etag -- The unquoted ETag for the response.
+
+  """
+
+  response['ETag'] = quote_etag(etag)
+  # The menu depends on who is looking at it.
+  patch_vary_headers(response, ('Cookie',))
+  return response
+
+def _menu_etag(request, menu_group, path):
+  """Helper function to generate an ETag for a menu group without rendering it.
+
+  The menu generated for a path depends only on the menu data and on who is
+  looking at it, so the ETag is built from the group's data version, the
+  user's audience (anonymous, authenticated or staff along with whether
+  they're active or a superuser and their permissions), the site and
+  language and the path itself.
+
+  Keyword arguments:
+  request -- The request object for the view.
+  menu_group -- The menu group being generated.
+  path -- The path the menu is being generated for.
+
+  """
+
+  user = request.user
+  if user.is_anonymous():
+    audience = 'anonymous'
+  else:
+    audience = ','.join(sorted(get_user_permissions(user)))
+    # Neither flag bumps a version when it changes so both are part of the
+    # audience.
+    audience = '%d:%d:%s' % (user.is_active, user.is_superuser, audience)
+    if user.is_staff:
+      audience = 'staff:%s' % audience
+    else:
+      audience = 'authenticated:%s' % audience
+  etag_parts = (get_menu_version(menu_group.pk),
+                audience,
+                getattr(settings, 'SITE_ID', ''),
+                get_language(),
+                path,
+               )
+  return md5_constructor(u':'.join([unicode(part) for part in etag_parts])\
+                           .encode('utf-8')).hexdigest()
+
+def _request_for_path(request, path):
+  """Helper function to produce a copy of a request for a different path.
+
+  Keyword arguments:
+  request -- The request object to copy.
+  path -- The path that the copy should represent (if None then the request
+          is returned untouched).
+
+  """
+
+  if not path:
+    return request
+  menu_request = copy.copy(request)
+  menu_request.path = path
+  # Remove the script prefix to get back to the path used for resolving.
+  script_prefix = get_script_prefix()
+  if path.startswith(script_prefix):
+    menu_request.path_info = path[len(script_prefix) - 1:]
+  else:
+    menu_request.path_info = path
+  return menu_request
+
+def _generate_menu_data(hierarchies, hier_index, selected_items,
+                        selected_params):
+  """Helper function to generate a data representation of a menu hierarchy.
+
+  This follows the same rules as _generate_menu_string in the menu_tags
+  template tag library but produces nested lists and dictionaries that are
+  suitable for serialising.
+
+  Keyword arguments:
+  hierarchies -- A dictionary mapping menu options (or the string "ROOT") to a
+                 list of options that should feature as a sub menu of that
+                 option.
+  hier_index -- The index into hierarchies dictionary to use.
+  selected_items -- A list of menu options that either match the current url
+                    or is an ancestor of an item that matches.
+  selected_params -- The keyword arguments that were extracted from the
+                     current url.
+
+  """
+
+  items = []
+  for opt in hierarchies[hier_index]:
+    opts = opt.as_data(selected_params, selected_items.get(opt, False))
+    for option_index, (string_params, opt_selected) in enumerate(opts):
+      item = { 'text': string_params['link_text'],
+               'title': string_params['title'],
+               'url': string_params['url'],
+             }
+      if opt.menu_option_id:
+        if opt.option_type == MenuOption.MODEL_MENU_OPTION:
+          # Model options have their position suffixed to the id.
+          item['id'] = '%s_%s' % (opt.menu_option_id, option_index + 1)
+        else:
+          item['id'] = opt.menu_option_id
+      if opt_selected:
+        item['selected'] = True
+      if (opt in hierarchies) and opt.show_hierarchy(opt_selected):
+        children = _generate_menu_data(hierarchies, opt, selected_items,
+                                       selected_params)
+        if children:
+          item['children'] = children
+      items.append(item)
+  return items